@@ -8,16 +8,11 @@ Fixed: Suppressed flashing console windows during subprocess calls (FFmpeg/FFpro
 
 import os
 import sys
-import shutil
-import subprocess
 import threading
-import json
 import queue
-import stat
-from pathlib import Path
-from datetime import datetime
-from typing import Optional, List, Dict
-from collections import Counter
+import time
+from array import array
+from datetime import datetime, timedelta
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 
@@ -27,12 +22,6 @@ from tkinter import ttk, filedialog, messagebox, scrolledtext
 LANGUAGE = 'JP' 
 # ==========================================
 
-# ■■■ FIX: ウィンドウ点滅防止用のフラグ設定 ■■■
-# Windowsの場合のみ、サブプロセス(FFmpeg)のウィンドウを表示しない設定を行う
-creation_flags = 0
-if sys.platform == "win32":
-    creation_flags = 0x08000000  # CREATE_NO_WINDOW
-
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
     try:
@@ -57,6 +46,9 @@ TRANSLATIONS = {
     
     'lbl_folder': {'JP': '対象フォルダ:', 'EN': 'Target Folder:'},
     'btn_browse': {'JP': '参照', 'EN': 'Browse'},
+    'lbl_workers': {'JP': '並列数:', 'EN': 'Workers:'},
+    'opt_only_flagged': {'JP': 'スキャン済みでメタデータの無い JPEG/PNG はコピーのみ（スマート削除時）',
+                         'EN': 'Copy JPEG/PNG the scan found metadata-free as-is (Smart mode)'},
     
     'btn_scan': {'JP': '🔍 スキャン', 'EN': '🔍 Scan'},
     'btn_diag': {'JP': '💊 診断', 'EN': '💊 Diagnose'},
@@ -70,6 +62,14 @@ TRANSLATIONS = {
     'col_file': {'JP': 'ファイル名', 'EN': 'Filename'},
     'col_score': {'JP': '危険度', 'EN': 'Risk Score'},
     'col_detail': {'JP': '検出情報', 'EN': 'Details'},
+    'col_folder': {'JP': 'フォルダ', 'EN': 'Folder'},
+    'lbl_min_score': {'JP': '危険度 ≥', 'EN': 'Score ≥'},
+    'lbl_type': {'JP': '種類:', 'EN': 'Type:'},
+    'lbl_filter_folder': {'JP': 'フォルダ:', 'EN': 'Folder:'},
+    'type_all': {'JP': 'すべて', 'EN': 'All'},
+    'type_image': {'JP': '画像', 'EN': 'Image'},
+    'type_video': {'JP': '動画', 'EN': 'Video'},
+    'type_audio': {'JP': '音声', 'EN': 'Audio'},
     
     'btn_orig': {'JP': '📂 元ファイル選択', 'EN': '📂 Select Original File'},
     'grp_before': {'JP': '📂 Before (元ファイル)', 'EN': '📂 Before (Original)'},
@@ -87,60 +87,172 @@ TRANSLATIONS = {
     'msg_done': {'JP': '完了', 'EN': 'Done'},
     'msg_success': {'JP': '✨ 成功', 'EN': '✨ Success'},
     'msg_fail': {'JP': '💀 失敗', 'EN': '💀 Failed'},
+    'msg_linked': {'JP': '🔗 重複 (リンク)', 'EN': '🔗 Duplicates linked'},
+    'msg_passed': {'JP': '⏩ メタデータなし (コピーのみ)', 'EN': '⏩ Metadata-free (copied)'},
+    'msg_bad_dest': {'JP': '出力先エラー', 'EN': 'Output Folder Error'},
+    'msg_bad_dest_detail': {'JP': 'このフォルダ (ドライブ直下など) は出力先が元フォルダの中になるため処理できません。',
+                            'EN': 'The output folder would be inside this folder (e.g. a drive root), so it cannot be cleaned.'},
     
     'log_scan_start': {'JP': '🔍 スキャン開始...', 'EN': '🔍 Scan started...'},
+    'log_index_hit': {'JP': '♻ インデックス再利用', 'EN': '♻ Reused from index'},
     'log_env_check': {'JP': '=== 環境チェック ===', 'EN': '=== Environment Check ==='},
     'log_clean_start': {'JP': 'フォルダ再作成', 'EN': 'Re-creating folder'},
     'log_diff': {'JP': '♻ 差分処理', 'EN': '♻ Differential processing'},
     'log_output': {'JP': '📂 出力先', 'EN': '📂 Output to'},
+    'log_no_ffmpeg': {'JP': '  → FFmpeg が必要な形式 (AVI/FLV/WMV/OGG 等) はクリーニングできません (出力せず失敗扱い)',
+                      'EN': '  → Formats that need FFmpeg (AVI/FLV/WMV/OGG, etc.) cannot be cleaned (skipped as failed)'},
 }
 
 def tr(key):
     return TRANSLATIONS.get(key, {}).get(LANGUAGE, key)
 
-try:
-    from PIL import Image, ImageOps
-    import piexif
-    HAS_PIL = True
-    PIL_VERSION = Image.__version__
-except ImportError:
-    HAS_PIL = False
-    PIL_VERSION = "N/A"
-
-def get_ffmpeg_path():
-    paths = [
-        os.path.join(os.path.dirname(sys.executable), '_internal', 'ffmpeg', 'ffmpeg.exe'),
-        os.path.join(os.getcwd(), 'ffmpeg', 'ffmpeg.exe'),
-        r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
-        r"C:\ffmpeg\bin\ffmpeg.exe",
-        os.path.expandvars(r"%LOCALAPPDATA%\FFmpeg\bin\ffmpeg.exe"),
-    ]
-    for p in paths:
-        if os.path.exists(p): return p
-    return shutil.which('ffmpeg')
-
-def get_ffprobe_path():
-    ff = get_ffmpeg_path()
-    if ff:
-        d = os.path.dirname(ff)
-        p = os.path.join(d, 'ffprobe.exe' if sys.platform == 'win32' else 'ffprobe')
-        if os.path.exists(p): return p
-    return shutil.which('ffprobe')
-
-def remove_readonly(func, path, _):
-    try:
-        os.chmod(path, stat.S_IWRITE)
-        func(path)
-    except Exception:
-        pass
+from metadata_engine import (MetadataEngine, IMAGE_EXTS, VIDEO_EXTS, AUDIO_EXTS, DEFAULT_WORKERS,
+                             HAS_PIL, PIL_VERSION, get_ffmpeg_path, get_ffprobe_path, clean_dest_root)
+
+class ProgressReporter:
+    """ ワーカースレッドからの進捗をためておき、interval 秒に 1 回だけ UI スレッドへ渡す。
+    apply には {'done', 'total', 'discovering', 'rate', 'eta', 'rows', 'status', 'files'} がまとめて届くので、
+    root.after の回数はファイル数ではなく経過時間に比例する。
+    total は走査しながら増えてもよい (discovering=True の間は ETA を出さない)。 """
+    def __init__(self, root, apply, interval=0.1):
+        self.root = root
+        self.apply = apply
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.start(0, "")
+
+    def start(self, total, status):
+        with self.lock:
+            self.total, self.status = total or 0, status
+            self.discovering = total is None
+            self.done = 0
+            self.rows = []
+            self.files = {}  # 処理中の大きなファイル → 進捗の文字列
+            self.t0 = self.last = time.monotonic()
+
+    def update(self, done, row=None, total=None, discovering=False, finished=None):
+        with self.lock:
+            self.done = done
+            if total is not None: self.total, self.discovering = total, discovering
+            if row is not None: self.rows.append(row)
+            if finished is not None: self.files.pop(finished, None)
+            snap = self._throttled()
+        if snap: self.root.after(0, lambda: self.apply(snap))
+
+    def file_progress(self, key, text):
+        """ 1 ファイルの処理中の進捗 (FFmpeg)。ファイルが終わったら update(finished=key) で消える """
+        with self.lock:
+            self.files[key] = text
+            snap = self._throttled()
+        if snap: self.root.after(0, lambda: self.apply(snap))
+
+    def _throttled(self):
+        now = time.monotonic()
+        if now - self.last < self.interval: return None
+        self.last = now
+        return self._snapshot(now)
+
+    def flush(self):
+        with self.lock:
+            snap = self._snapshot(time.monotonic())
+        self.root.after(0, lambda: self.apply(snap))
+
+    def _snapshot(self, now):
+        elapsed = now - self.t0
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 and not self.discovering else None
+        rows, self.rows = self.rows, []
+        return {'done': self.done, 'total': self.total, 'discovering': self.discovering,
+                'rate': rate, 'eta': eta, 'rows': rows, 'status': self.status, 'files': list(self.files.values())}
+
+class ResultStore:
+    """ スキャン結果 (危険度 30 以上) を列ごとの配列で保持する。
+    1 件あたりファイル名の文字列と数バイト (フォルダ番号・拡張子番号・危険度・検出フラグ) だけで、
+    フィルタ・並べ替えの結果は order (インデックスの配列) として持つ。Treeview には表示範囲だけを入れる。 """
+    GPS, AUTHOR, AI = 1, 2, 4
+    KINDS = (None, IMAGE_EXTS, VIDEO_EXTS, AUDIO_EXTS)  # 種類フィルタ (すべて / 画像 / 動画 / 音声)
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.names = []
+        self.dirs = array('I')
+        self.exts = array('H')
+        self.scores = array('B')
+        self.flags = array('B')
+        self.dir_names, self._dir_ids = [], {}
+        self.ext_names, self._ext_ids = [], {}
+        self.order = array('I')
+        self.min_score, self.kind, self.folder = 0, 0, ""
+        self.sort_key, self.reverse = None, False
+        self.stale = False  # 並べ替え中に追加された行がある
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def _intern(value, names, ids):
+        i = ids.get(value)
+        if i is None:
+            i = ids[value] = len(names)
+            names.append(value)
+        return i
+
+    def add(self, path, score, flags):
+        d, name = os.path.split(path)
+        ext = os.path.splitext(name)[1].lower()
+        self.names.append(name)
+        self.dirs.append(self._intern(d, self.dir_names, self._dir_ids))
+        self.exts.append(self._intern(ext, self.ext_names, self._ext_ids))
+        self.scores.append(score)
+        self.flags.append(flags)
+        kinds = self.KINDS[self.kind]
+        if (score >= self.min_score and (kinds is None or ext in kinds)
+                and (not self.folder or self.folder.lower() in d.lower())):
+            self.order.append(len(self.names) - 1)
+            if self.sort_key: self.stale = True
+
+    def path(self, i):
+        return os.path.join(self.dir_names[self.dirs[i]], self.names[i])
+
+    def _matcher(self):
+        min_score, kinds, folder = self.min_score, self.KINDS[self.kind], self.folder.lower()
+        ok_ext = None if kinds is None else {i for i, e in enumerate(self.ext_names) if e in kinds}
+        ok_dir = None if not folder else {i for i, d in enumerate(self.dir_names) if folder in d.lower()}
+        scores, exts, dirs = self.scores, self.exts, self.dirs
+        return lambda i: (scores[i] >= min_score and (ok_ext is None or exts[i] in ok_ext)
+                          and (ok_dir is None or dirs[i] in ok_dir))
+
+    def set_filter(self, min_score=0, kind=0, folder=""):
+        self.min_score, self.kind, self.folder = min_score, kind, folder
+        self.refresh()
+
+    def set_sort(self, key):
+        """ key: file / score / details / folder。同じ列をもう一度指定すると逆順 """
+        self.reverse = not self.reverse if key == self.sort_key else key == 'score'
+        self.sort_key = key
+        self.refresh()
+
+    def refresh(self):
+        match = self._matcher()
+        idx = [i for i in range(len(self.names)) if match(i)]
+        if self.sort_key:
+            dir_names, names = self.dir_names, self.names
+            key = {'file': lambda i: names[i].lower(), 'score': self.scores.__getitem__,
+                   'details': self.flags.__getitem__,
+                   'folder': lambda i: (dir_names[self.dirs[i]].lower(), names[i].lower())}[self.sort_key]
+            idx.sort(key=key, reverse=self.reverse)
+        self.order = array('I', idx)
+        self.stale = False
 
 class MetadataApp:
     VERSION = "2.0.1"
     APP_ID = "takejii_app_001"
     
-    IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.bmp'}
-    VIDEO_EXTS = {'.mp4', '.mov', '.webm', '.mkv', '.avi', '.flv', '.wmv'}
-    AUDIO_EXTS = {'.mp3', '.wav', '.flac', '.ogg', '.opus', '.m4a', '.aac'}
+    IMAGE_EXTS = IMAGE_EXTS
+    VIDEO_EXTS = VIDEO_EXTS
+    AUDIO_EXTS = AUDIO_EXTS
     
     def __init__(self, root):
         self.root = root
@@ -154,11 +266,16 @@ class MetadataApp:
             pass
 
         self.log_queue = queue.Queue()
-        self.ffmpeg_path = None
-        self.ffprobe_path = None
         self.source_folder = tk.StringVar()
         self.clean_mode = tk.StringVar(value="smart")
-        self.stop_requested = False
+        self.workers = tk.IntVar(value=DEFAULT_WORKERS)
+        self.only_flagged = tk.BooleanVar(value=False)
+        self.reporter = ProgressReporter(self.root, self._apply_progress)
+        self.result_store = ResultStore()
+        self.result_offset = 0
+        self._filter_job = None
+        # スキャン・クリーニング本体 (metadata_engine.py)。進捗は _on_engine_event で受け取る
+        self.engine = MetadataEngine(on_event=self._on_engine_event)
         
         self.create_widgets()
         self.check_environment()
@@ -196,12 +313,18 @@ class MetadataApp:
                        variable=self.clean_mode, value="smart").pack(anchor=tk.W)
         ttk.Radiobutton(m_frame, text=tr('mode_full'), 
                        variable=self.clean_mode, value="full").pack(anchor=tk.W)
+        ttk.Checkbutton(m_frame, text=tr('opt_only_flagged'), variable=self.only_flagged).pack(anchor=tk.W, pady=(5, 0))
         
         ttk.Label(main, text=tr('lbl_folder')).pack(anchor=tk.W, pady=5)
         f_frame = ttk.Frame(main)
         f_frame.pack(fill=tk.X, pady=2)
         ttk.Entry(f_frame, textvariable=self.source_folder).pack(side=tk.LEFT, fill=tk.X, expand=True)
         ttk.Button(f_frame, text=tr('btn_browse'), command=self.browse_folder).pack(side=tk.LEFT, padx=5)
+
+        w_frame = ttk.Frame(main)
+        w_frame.pack(fill=tk.X, pady=2)
+        ttk.Label(w_frame, text=tr('lbl_workers')).pack(side=tk.LEFT)
+        ttk.Spinbox(w_frame, from_=1, to=64, width=5, textvariable=self.workers).pack(side=tk.LEFT, padx=5)
         
         b_frame = ttk.Frame(main)
         b_frame.pack(pady=10, fill=tk.X)
@@ -235,22 +358,45 @@ class MetadataApp:
         self.summary_text = tk.Text(main, height=14, state=tk.DISABLED, font=("Consolas", 9))
         self.summary_text.pack(fill=tk.X, pady=5)
         
+        flt = ttk.Frame(main)
+        flt.pack(fill=tk.X, pady=2)
+        ttk.Label(flt, text=tr('lbl_min_score')).pack(side=tk.LEFT)
+        self.filter_score = ttk.Combobox(flt, values=("30", "60", "100"), width=4, state="readonly")
+        self.filter_score.current(0)
+        self.filter_score.pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(flt, text=tr('lbl_type')).pack(side=tk.LEFT)
+        self.filter_kind = ttk.Combobox(flt, width=6, state="readonly",
+                                        values=(tr('type_all'), tr('type_image'), tr('type_video'), tr('type_audio')))
+        self.filter_kind.current(0)
+        self.filter_kind.pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(flt, text=tr('lbl_filter_folder')).pack(side=tk.LEFT)
+        self.filter_folder = tk.StringVar()
+        ttk.Entry(flt, textvariable=self.filter_folder).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=2)
+        self.filter_score.bind("<<ComboboxSelected>>", lambda e: self._apply_result_filter())
+        self.filter_kind.bind("<<ComboboxSelected>>", lambda e: self._apply_result_filter())
+        self.filter_folder.trace_add("write", lambda *a: self._schedule_result_filter())
+
         tree_frame = ttk.Frame(main)
         tree_frame.pack(fill=tk.BOTH, expand=True)
         
-        self.file_tree = ttk.Treeview(tree_frame, columns=("file", "score", "details"), show="headings")
-        self.file_tree.heading("file", text=tr('col_file'))
-        self.file_tree.heading("score", text=tr('col_score'))
-        self.file_tree.heading("details", text=tr('col_detail'))
+        # ■■■ 仮想スクロール: Treeview には画面に入る行だけを入れ、スクロールバーは result_offset を動かす ■■■
+        self.file_tree = ttk.Treeview(tree_frame, columns=("file", "score", "details", "folder"),
+                                      show="headings", selectmode="browse")
+        for col, key in (("file", 'col_file'), ("score", 'col_score'), ("details", 'col_detail'), ("folder", 'col_folder')):
+            self.file_tree.heading(col, text=tr(key), command=lambda c=col: self._sort_results(c))
         self.file_tree.column("file", width=150)
         self.file_tree.column("score", width=60)
         self.file_tree.column("details", width=200)
+        self.file_tree.column("folder", width=150)
         
-        sc = ttk.Scrollbar(tree_frame, orient="vertical", command=self.file_tree.yview)
-        self.file_tree.configure(yscrollcommand=sc.set)
-        sc.pack(side=tk.RIGHT, fill=tk.Y)
+        self.result_scroll = ttk.Scrollbar(tree_frame, orient="vertical", command=self._scroll_results)
+        self.result_scroll.pack(side=tk.RIGHT, fill=tk.Y)
         self.file_tree.pack(fill=tk.BOTH, expand=True)
         self.file_tree.bind("<Double-1>", self.show_file_detail)
+        self.file_tree.bind("<Configure>", lambda e: self._render_results())
+        self.file_tree.bind("<MouseWheel>", lambda e: self._scroll_results('scroll', -1 if e.delta > 0 else 1, 'units'))
+        self.file_tree.bind("<Button-4>", lambda e: self._scroll_results('scroll', -1, 'units'))
+        self.file_tree.bind("<Button-5>", lambda e: self._scroll_results('scroll', 1, 'units'))
 
     def create_compare_tab(self, parent):
         main = ttk.Frame(parent, padding="5")
@@ -292,14 +438,15 @@ class MetadataApp:
         if HAS_PIL: self.log(f"✓ Pillow: {PIL_VERSION}")
         else: self.log("✗ Pillow: Not Installed", error=True)
         
-        self.ffmpeg_path = get_ffmpeg_path()
-        if self.ffmpeg_path: self.log(f"✓ FFmpeg: {self.ffmpeg_path}")
+        self.engine.ffmpeg_path = get_ffmpeg_path()
+        if self.engine.ffmpeg_path: self.log(f"✓ FFmpeg: {self.engine.ffmpeg_path}")
         else:
+            # 画像・MP4/MOV・MP3/FLAC/WAV は FFmpeg なしでクリーニングできるので、実行ボタンは無効にしない
             self.log("✗ FFmpeg: Not Found", error=True)
-            self.start_btn.config(state=tk.DISABLED)
+            self.log(tr('log_no_ffmpeg'), error=True)
         
-        self.ffprobe_path = get_ffprobe_path()
-        if self.ffprobe_path: self.log(f"✓ FFprobe: {self.ffprobe_path}")
+        self.engine.ffprobe_path = get_ffprobe_path()
+        if self.engine.ffprobe_path: self.log(f"✓ FFprobe: {self.engine.ffprobe_path}")
         else: self.log("✗ FFprobe: Not Found", error=True)
         self.log("===================\n")
 
@@ -313,72 +460,134 @@ class MetadataApp:
         t = threading.Thread(target=target, args=args, daemon=True)
         t.start()
 
+    def _on_engine_event(self, ev):
+        """ エンジンからの通知 (スキャン/クリーニングのスレッドから呼ばれる)。
+        ファイルごとの進捗は ProgressReporter にためて、まとめて画面へ反映する """
+        kind = ev['event']
+        if kind == 'log':
+            self.log(ev['message'], ev['error'])
+        elif kind == 'scan_start':
+            self.reporter.start(ev['total'], tr('status_scanning'))
+        elif kind == 'clean_start':
+            key = {'overwrite': 'log_clean_start', 'diff': 'log_diff'}.get(ev['strategy'], 'log_output')
+            self.log(f"{tr(key)}: {ev['dest']}")
+            self.reporter.start(ev['total'], tr('status_processing'))
+        elif kind == 'scan_file':
+            self.reporter.update(ev['index'], self._risk_row(ev) if ev.get('score', 0) >= 30 else None)
+        elif kind == 'clean_file':
+            self.reporter.update(ev['index'], total=ev['total'], discovering=ev['discovering'], finished=ev['src'])
+        elif kind == 'clean_progress':
+            pct = f"{min(99, ev['bytes'] * 100 // ev['total'])}%" if ev['total'] else f"{ev['bytes'] / 2**20:.0f}MB"
+            name = os.path.basename(ev['src']) + (f" +{ev['files'] - 1}" if ev['files'] > 1 else "")
+            self.reporter.file_progress(ev['src'], f"{name} {pct}")
+        elif kind == 'scan_done':
+            self.reporter.flush()
+        elif kind == 'clean_done':
+            self.reporter.update(ev['done'], total=ev['total'])
+            self.reporter.flush()
+
+    def _risk_row(self, ev):
+        flags = ((ResultStore.GPS if ev['has_gps'] else 0) | (ResultStore.AUTHOR if ev['has_author'] else 0)
+                 | (ResultStore.AI if ev['has_ai'] else 0))
+        return (ev['path'], ev['score'], flags)
+
+    def _apply_progress(self, snap):
+        self.progress.configure(maximum=max(1, snap['total']), value=snap['done'])
+        text = f"{snap['status']}{snap['done']}/{snap['total']}" + ("+" if snap['discovering'] else "")
+        if snap['rate']:
+            eta = f", ETA {timedelta(seconds=int(snap['eta']))}" if snap['eta'] is not None else ""
+            text += f"  ({snap['rate']:.1f}/s{eta})"
+        if snap['files']: text += "  🎬 " + ", ".join(snap['files'][:2]) + (" …" if len(snap['files']) > 2 else "")
+        self.progress_label.config(text=text)
+        if snap['rows']:
+            for row in snap['rows']: self.result_store.add(*row)
+            self._render_results()
+
+    # === RESULTS VIEW ===
+    def _result_values(self, i):
+        store = self.result_store
+        flags, score = store.flags[i], store.scores[i]
+        dets = []
+        if flags & ResultStore.GPS: dets.append(tr('msg_gps'))
+        if flags & ResultStore.AUTHOR: dets.append(tr('msg_author'))
+        if flags & ResultStore.AI: dets.append(tr('msg_ai'))
+        icon = "🔴" if score >= 60 else "🟡"
+        return (store.names[i], f"{icon} {score}", ", ".join(dets), store.dir_names[store.dirs[i]])
+
+    def _result_page_size(self):
+        row_h = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        return max(1, self.file_tree.winfo_height() // row_h - 1)
+
+    def _render_results(self):
+        """ result_offset から 1 画面分だけを Treeview に入れる (既存の行は値だけ差し替える) """
+        order = self.result_store.order
+        n, page = len(order), self._result_page_size()
+        self.result_offset = max(0, min(self.result_offset, n - page))
+        rows = [self._result_values(i) for i in order[self.result_offset:self.result_offset + page]]
+        items = self.file_tree.get_children()
+        for k, values in enumerate(rows):
+            if k < len(items): self.file_tree.item(items[k], values=values)
+            else: self.file_tree.insert("", tk.END, values=values)
+        if len(items) > len(rows): self.file_tree.delete(*items[len(rows):])
+        if n: self.result_scroll.set(self.result_offset / n, min(1.0, (self.result_offset + page) / n))
+        else: self.result_scroll.set(0, 1)
+
+    def _scroll_results(self, *args):
+        page = self._result_page_size()
+        if args[0] == 'moveto':
+            self.result_offset = int(float(args[1]) * len(self.result_store.order))
+        elif args[0] == 'scroll':
+            self.result_offset += int(args[1]) * (page if args[2] == 'pages' else 3)
+        self._render_results()
+
+    def _sort_results(self, col):
+        self.result_store.set_sort(col)
+        self.result_offset = 0
+        self._render_results()
+
+    def _schedule_result_filter(self):
+        # フォルダ名の入力中は毎キーで絞り込まず、入力が止まってから 1 回だけ
+        if self._filter_job: self.root.after_cancel(self._filter_job)
+        self._filter_job = self.root.after(300, self._apply_result_filter)
+
+    def _apply_result_filter(self):
+        self._filter_job = None
+        self.result_store.set_filter(int(self.filter_score.get() or 0), max(0, self.filter_kind.current()),
+                                     self.filter_folder.get().strip())
+        self.result_offset = 0
+        self._render_results()
+
     # === SCAN ===
     def scan_folder(self):
         source = self.source_folder.get()
         if not source: return
-        self.stop_requested = False
+        self.engine.stop_requested = False
         self.stop_btn.config(state=tk.NORMAL)
-        self.file_tree.delete(*self.file_tree.get_children())
-        self.run_thread(self._scan_thread, source)
+        self.result_store.clear()
+        self._apply_result_filter()
+        self.run_thread(self._scan_thread, source, self.get_workers())
 
-    def _scan_thread(self, folder):
+    def _scan_thread(self, folder, workers=1):
         self.log(tr('log_scan_start'))
-        all_exts = self.IMAGE_EXTS | self.VIDEO_EXTS | self.AUDIO_EXTS
-        files = []
-        for r, d, f in os.walk(folder):
-            if '_clean' in r: continue
-            for file in f:
-                if os.path.splitext(file)[1].lower() in all_exts:
-                    files.append(os.path.join(r, file))
-        
-        total = len(files)
-        ext_counts = Counter([os.path.splitext(f)[1].lower() for f in files])
-        ext_summary_lines = [f"  {k}: {v}" for k, v in sorted(ext_counts.items())]
-        ext_summary_text = "\n".join(ext_summary_lines)
-
-        self.root.after(0, lambda: self.progress.configure(maximum=total))
-        
-        gps_c = author_c = ai_c = 0
-        danger = []
-        
-        for i, path in enumerate(files):
-            if self.stop_requested: break
-            self.root.after(0, lambda v=i: self.progress.configure(value=v+1))
-            self.root.after(0, lambda v=i: self.progress_label.config(text=f"{tr('status_scanning')}{v+1}/{total}"))
-            
-            meta = self._get_simple_meta_info(path)
-            if meta['has_gps']: gps_c += 1
-            if meta['has_author']: author_c += 1
-            if meta['has_ai']: ai_c += 1
-            
-            score = 0
-            if meta['has_gps']: score += 40
-            if meta['has_author']: score += 30
-            if meta['has_ai']: score += 30
-            
-            if score >= 30:
-                dets = []
-                if meta['has_gps']: dets.append(tr('msg_gps'))
-                if meta['has_author']: dets.append(tr('msg_author'))
-                if meta['has_ai']: dets.append(tr('msg_ai'))
-                danger.append((os.path.basename(path), score, ", ".join(dets)))
-                icon = "🔴" if score >= 60 else "🟡"
-                self.root.after(0, lambda p=os.path.basename(path), s=score, d=", ".join(dets), i=icon: 
-                                self.file_tree.insert("", tk.END, values=(p, f"{i} {s}", d)))
+        self.engine.workers = workers
+        res = self.engine.scan(folder)
+        ext_summary_text = "\n".join(f"  {k}: {v}" for k, v in res['exts'].items())
 
         summary = f"""{tr('msg_scan_done')}
-{tr('msg_total')}: {total}
+{tr('msg_total')}: {res['total']}
 
 📊 Exts:
 {ext_summary_text}
 
 🔴 {tr('msg_danger')}:
-  📍 GPS: {gps_c}
-  👤 Author: {author_c}
-  🤖 AI Info: {ai_c}
+  📍 GPS: {res['gps']}
+  👤 Author: {res['author']}
+  🤖 AI Info: {res['ai']}
+
+{tr('msg_high_risk')}: {res['high_risk']}"""
 
-{tr('msg_high_risk')}: {len(danger)}"""
+        if res['cached'] is not None:
+            self.log(f"{tr('log_index_hit')}: {res['cached']}/{res['total']}")
 
         self.root.after(0, lambda: self.summary_text.configure(state=tk.NORMAL))
         self.root.after(0, lambda: self.summary_text.delete(1.0, tk.END))
@@ -388,68 +597,35 @@ class MetadataApp:
         self.root.after(0, lambda: self._on_scan_finished(summary))
 
     def _on_scan_finished(self, summary):
+        if self.result_store.stale:
+            self.result_store.refresh()
+            self._render_results()
         messagebox.showinfo(tr('msg_scan_done'), summary)
         self.reset_progress()
         self.stop_btn.config(state=tk.DISABLED)
         self.scan_btn.config(state=tk.NORMAL)
 
-    def _get_simple_meta_info(self, path):
-        info = {'has_gps': False, 'has_author': False, 'has_ai': False}
-        ext = os.path.splitext(path)[1].lower()
-        try:
-            if ext in self.IMAGE_EXTS and HAS_PIL:
-                img = Image.open(path)
-                if ext == '.png':
-                    if hasattr(img, 'info'):
-                        for k, v in img.info.items():
-                            if isinstance(v, str) and ('workflow' in v.lower() or 'prompt' in v.lower()):
-                                info['has_ai'] = True
-                elif ext in ['.jpg', '.jpeg']:
-                    exif = piexif.load(path)
-                    if exif.get('GPS'): info['has_gps'] = True
-                    if any(k in exif.get('0th', {}) for k in [piexif.ImageIFD.Artist, piexif.ImageIFD.Copyright]):
-                        info['has_author'] = True
-            
-            elif ext in (self.VIDEO_EXTS | self.AUDIO_EXTS) and self.ffprobe_path:
-                # ■■■ FIX: creationflagsを追加 ■■■
-                cmd = [self.ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', path]
-                res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=3, creationflags=creation_flags)
-                if res.returncode == 0:
-                    data = json.loads(res.stdout)
-                    tags = data.get('format', {}).get('tags', {})
-                    for k, v in tags.items():
-                        kl = k.lower()
-                        if 'location' in kl or 'gps' in kl: info['has_gps'] = True
-                        if 'artist' in kl or 'author' in kl: info['has_author'] = True
-                        if 'comment' in kl and ('workflow' in str(v) or 'prompt' in str(v)): info['has_ai'] = True
-        except: pass
-        return info
-
     # === DIAGNOSTIC ===
     def run_diagnostic(self):
         source = self.source_folder.get()
         if not source: return
-        self.stop_requested = False
+        self.engine.stop_requested = False
         self.stop_btn.config(state=tk.NORMAL)
         self.run_thread(self._diagnostic_thread, source)
         
     def _diagnostic_thread(self, folder):
         self.log("\n=== 💊 DIAGNOSTIC ===")
-        all_files = []
-        for r, d, f in os.walk(folder):
-            for file in f:
-                if os.path.splitext(file)[1].lower() in (self.IMAGE_EXTS | self.VIDEO_EXTS):
-                    all_files.append(os.path.join(r, file))
+        all_files = [f[0] for f in self.engine.walker.files(folder, self.IMAGE_EXTS | self.VIDEO_EXTS)]
         
         targets = all_files[:5]
         self.log(f"Checking top {len(targets)} files...")
         
         for path in targets:
-            if self.stop_requested: break
+            if self.engine.stop_requested: break
             fname = os.path.basename(path)
             self.log(f"\n📄 {fname}")
             
-            detail = self.extract_metadata_detail(path)
+            detail = self.engine.extract_metadata_detail(path)
             lines = detail.split('\n')
             for line in lines[:20]:
                 if line.strip() and "File:" not in line and "Size:" not in line:
@@ -464,13 +640,16 @@ class MetadataApp:
         source = self.source_folder.get()
         if not source: return
         
-        parent = os.path.dirname(source)
-        name = os.path.basename(source)
-        dest = os.path.join(parent, f"{name}_clean")
+        try:
+            dest = clean_dest_root(source)
+        except ValueError:
+            messagebox.showerror(tr('msg_bad_dest'), tr('msg_bad_dest_detail'))
+            return
+        name = os.path.basename(os.path.abspath(source))
         
         strat = "new"
         if os.path.exists(dest):
-            exist = sum(1 for r, d, f in os.walk(dest) for file in f)
+            exist = sum(len(files) for _, files in self.engine.walker.iter_dirs(dest))
             if exist > 0:
                 ans = messagebox.askyesnocancel("Folder Exists", 
                     f"{name}_clean exists ({exist} files)\n\n"
@@ -479,65 +658,33 @@ class MetadataApp:
                 if ans is True: strat = "diff"
                 if ans is False: strat = "overwrite"
         
-        self.stop_requested = False
+        self.engine.stop_requested = False
+        self.engine.only_flagged = self.only_flagged.get()
         self.stop_btn.config(state=tk.NORMAL)
         self.start_btn.config(state=tk.DISABLED)
-        self.run_thread(self._clean_thread, source, strat)
+        self.run_thread(self._clean_thread, source, strat, self.clean_mode.get(), self.get_workers())
 
-    def _clean_thread(self, source, strat):
+    def get_workers(self):
         try:
-            parent = os.path.dirname(source)
-            name = os.path.basename(source)
-            dest_root = os.path.join(parent, f"{name}_clean")
-            
-            if strat == "overwrite":
-                self.log(f"{tr('log_clean_start')}: {dest_root}")
-                if os.path.exists(dest_root):
-                    shutil.rmtree(dest_root, onerror=remove_readonly)
-                os.makedirs(dest_root)
-            elif strat == "diff":
-                self.log(f"{tr('log_diff')}: {dest_root}")
-                if not os.path.exists(dest_root): os.makedirs(dest_root)
-            else:
-                self.log(f"{tr('log_output')}: {dest_root}")
-                if not os.path.exists(dest_root): os.makedirs(dest_root)
-            
-            targets = []
-            for r, d, f in os.walk(source):
-                if '_clean' in r: continue
-                for file in f:
-                    ext = os.path.splitext(file)[1].lower()
-                    if ext in self.IMAGE_EXTS | self.VIDEO_EXTS | self.AUDIO_EXTS:
-                        src = os.path.join(r, file)
-                        rel = os.path.relpath(src, source)
-                        dst = os.path.join(dest_root, rel)
-                        if strat == "diff" and os.path.exists(dst):
-                            if os.path.getmtime(src) <= os.path.getmtime(dst): continue
-                        targets.append((src, dst))
-
-            if not targets:
+            return max(1, int(self.workers.get()))
+        except (tk.TclError, ValueError):
+            return DEFAULT_WORKERS
+
+    def _clean_thread(self, source, strat, mode="smart", workers=1):
+        try:
+            self.engine.workers = workers
+            res = self.engine.clean(source, strat, mode)
+
+            if not res['total']:
                 self.log(tr('msg_no_target'))
                 self.root.after(0, lambda: messagebox.showinfo(tr('msg_done'), tr('msg_no_target')))
                 self.root.after(0, lambda: self.reset_progress())
                 self.root.after(0, lambda: self._enable_buttons())
                 return
 
-            self.root.after(0, lambda: self.progress.configure(maximum=len(targets)))
-            ok = err = 0
-            
-            for i, (src, dst) in enumerate(targets):
-                if self.stop_requested: break
-                self.root.after(0, lambda v=i: self.progress.configure(value=v+1))
-                self.root.after(0, lambda v=i, t=len(targets): self.progress_label.config(text=f"{tr('status_processing')}{v+1}/{t}"))
-                try:
-                    res = self.process_file(src, dst)
-                    if res: ok += 1
-                    else: err += 1
-                except Exception as e:
-                    self.log(f"⚠ Err: {os.path.basename(src)} - {e}", True)
-                    err += 1
-            
-            msg = f"{tr('msg_done')}\n{tr('msg_success')}: {ok}\n{tr('msg_fail')}: {err}"
+            msg = f"{tr('msg_done')}\n{tr('msg_success')}: {res['ok']}\n{tr('msg_fail')}: {res['err']}"
+            if res['linked']: msg += f"\n{tr('msg_linked')}: {res['linked']}"
+            if res['passed']: msg += f"\n{tr('msg_passed')}: {res['passed']}"
             self.log(msg.replace('\n', ', '))
             self.root.after(0, lambda: self._on_clean_finished(msg))
             
@@ -554,62 +701,6 @@ class MetadataApp:
         self.stop_btn.config(state=tk.DISABLED)
         self.start_btn.config(state=tk.NORMAL)
 
-    def process_file(self, src, dst):
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        ext = os.path.splitext(src)[1].lower()
-        
-        if ext in self.IMAGE_EXTS and HAS_PIL and self.clean_mode.get() == "smart":
-            try:
-                if ext in ['.jpg', '.jpeg']:
-                    shutil.copy2(src, dst)
-                    try:
-                        ed = piexif.load(src)
-                        new_ed = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
-                        if 274 in ed["0th"]: new_ed["0th"][274] = ed["0th"][274]
-                        piexif.insert(piexif.dump(new_ed), dst)
-                        return True
-                    except: pass
-
-                img = Image.open(src)
-                img = ImageOps.exif_transpose(img)
-                data = list(img.getdata())
-                new_img = Image.new(img.mode, img.size)
-                new_img.putdata(data)
-                
-                if ext == '.png': new_img.save(dst, optimize=True)
-                elif ext in ['.jpg', '.jpeg']: new_img.save(dst, quality=95)
-                else: new_img.save(dst)
-                return True
-            except Exception as e:
-                self.log(f"Img Err: {e}", True)
-                shutil.copy2(src, dst)
-                return False
-
-        d_name, b_name = os.path.split(dst)
-        temp = os.path.join(d_name, f"temp_{b_name}")
-        
-        try:
-            cmd = []
-            if ext in self.VIDEO_EXTS | self.AUDIO_EXTS:
-                cmd = [self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error',
-                       '-i', src, '-map_metadata', '-1', '-c', 'copy', temp]
-            else:
-                shutil.copy2(src, dst)
-                return True
-
-            # ■■■ FIX: creationflagsを追加 ■■■
-            subprocess.run(cmd, check=True, creationflags=creation_flags)
-            if os.path.exists(temp):
-                if os.path.exists(dst): os.remove(dst)
-                os.rename(temp, dst)
-                return True
-            raise Exception("Output fail")
-        except Exception as e:
-            self.log(f"FFmpeg Err: {e}", True)
-            if os.path.exists(temp): os.remove(temp)
-            shutil.copy2(src, dst)
-            return False
-
     def select_original_file(self):
         f = filedialog.askopenfilename()
         if f: self.run_thread(self._load_compare_info, f)
@@ -617,7 +708,7 @@ class MetadataApp:
     def _load_compare_info(self, f_path):
         self.root.after(0, lambda: self.before_text.delete(1.0, tk.END))
         self.root.after(0, lambda: self.before_text.insert(1.0, "Loading..."))
-        m_before = self.extract_metadata_detail(f_path)
+        m_before = self.engine.extract_metadata_detail(f_path)
         self.root.after(0, lambda: self.before_text.delete(1.0, tk.END))
         self.root.after(0, lambda: self.before_text.insert(1.0, m_before))
         
@@ -643,66 +734,22 @@ class MetadataApp:
         self.root.after(0, lambda: self.after_text.delete(1.0, tk.END))
         if clean_file:
             self.root.after(0, lambda: self.after_text.insert(1.0, "Loading..."))
-            m_after = self.extract_metadata_detail(clean_file)
+            m_after = self.engine.extract_metadata_detail(clean_file)
             self.root.after(0, lambda: self.after_text.delete(1.0, tk.END))
             self.root.after(0, lambda: self.after_text.insert(1.0, m_after))
         else:
             self.root.after(0, lambda: self.after_text.insert(1.0, "No cleaned file found"))
 
-    def extract_metadata_detail(self, path):
-        text = f"File: {os.path.basename(path)}\nSize: {os.path.getsize(path):,} bytes\n" + "-"*30 + "\n"
-        ext = os.path.splitext(path)[1].lower()
-        LIMIT = 1000
-        
-        if self.ffprobe_path and (ext in self.VIDEO_EXTS | self.AUDIO_EXTS):
-            try:
-                # ■■■ FIX: creationflagsを追加 ■■■
-                cmd = [self.ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', path]
-                res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=5, creationflags=creation_flags)
-                data = json.loads(res.stdout)
-                tags = data.get('format', {}).get('tags', {})
-                if not tags: text += "✓ No Metadata"
-                for k, v in tags.items():
-                    s = str(v)
-                    if len(s) > LIMIT: s = s[:LIMIT] + f"\n... ({len(s)-LIMIT:,} more)"
-                    text += f"[{k}] : {s}\n\n"
-            except Exception as e: text += f"Error: {e}"
-        elif HAS_PIL and ext in self.IMAGE_EXTS:
-            try:
-                img = Image.open(path)
-                if ext == '.png':
-                    if not img.info: text += "✓ No PNG Info"
-                    for k, v in img.info.items():
-                        s = str(v)
-                        if len(s) > LIMIT: s = s[:LIMIT] + f"\n... ({len(s)-LIMIT:,} more)"
-                        text += f"[{k}] : {s}\n\n"
-                elif ext in ['.jpg', '.jpeg']:
-                    ed = piexif.load(path)
-                    has_d = False
-                    for ifd in ed:
-                        if ifd == "thumbnail": continue
-                        if ed[ifd]:
-                            text += f"--- {ifd} ---\n"
-                            for tag, val in ed[ifd].items():
-                                has_d = True
-                                s = str(val)
-                                if isinstance(val, bytes) and len(val) > 100: s = f"<{len(val)} bytes binary>"
-                                elif len(s) > LIMIT: s = s[:LIMIT] + f"\n... ({len(s)-LIMIT:,} more)"
-                                t_name = piexif.TAGS[ifd].get(tag, {}).get('name', tag)
-                                text += f"{t_name}: {s}\n"
-                    if not has_d: text += "✓ No Exif Data"
-            except Exception as e: text += f"Error: {e}"
-        return text
-
     def stop_process(self):
-        self.stop_requested = True
+        self.engine.stop()
         self.log("Stopping...")
 
     def show_file_detail(self, event):
         sel = self.file_tree.selection()
         if not sel: return
-        fname = self.file_tree.item(sel[0])['values'][0]
-        self.log(f"🔍 Detail: {fname}")
+        k = self.result_offset + self.file_tree.index(sel[0])
+        if k < len(self.result_store.order):
+            self.log(f"🔍 Detail: {self.result_store.path(self.result_store.order[k])}")
 
 if __name__ == '__main__':
     root = tk.Tk()
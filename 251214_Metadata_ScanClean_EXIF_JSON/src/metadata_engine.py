@@ -0,0 +1,2618 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metadata Scan&Clean - Engine
+takejii_app_001
+スキャン / クリーニング処理本体 (tkinter 非依存)。GUI (metadata_cleaner_global.py) から import して使うほか、
+単体で CLI としても動く:
+    python metadata_engine.py scan  <folder>
+    python metadata_engine.py clean <folder> [--overwrite] [--mode full]
+    python metadata_engine.py diff  <folder>
+結果は 1 行 1 JSON (イベント) で標準出力へ流す。
+"""
+
+import os
+import sys
+import shutil
+import subprocess
+import threading
+import time
+import json
+import re
+import queue
+import stat
+import io
+import struct
+import zlib
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ■■■ FIX: ウィンドウ点滅防止用のフラグ設定 ■■■
+# Windowsの場合のみ、サブプロセス(FFmpeg)のウィンドウを表示しない設定を行う
+creation_flags = 0
+if sys.platform == "win32":
+    creation_flags = 0x08000000  # CREATE_NO_WINDOW
+
+try:
+    from PIL import Image, ImageOps
+    import piexif
+    HAS_PIL = True
+    PIL_VERSION = Image.__version__
+except ImportError:
+    HAS_PIL = False
+    PIL_VERSION = "N/A"
+
+try:
+    import fcntl  # reflink (FICLONE) 用。Windows には無い
+except ImportError:
+    fcntl = None
+
+def get_ffmpeg_path():
+    paths = [
+        os.path.join(os.path.dirname(sys.executable), '_internal', 'ffmpeg', 'ffmpeg.exe'),
+        os.path.join(os.getcwd(), 'ffmpeg', 'ffmpeg.exe'),
+        r"C:\Program Files\ffmpeg\bin\ffmpeg.exe",
+        r"C:\ffmpeg\bin\ffmpeg.exe",
+        os.path.expandvars(r"%LOCALAPPDATA%\FFmpeg\bin\ffmpeg.exe"),
+    ]
+    for p in paths:
+        if os.path.exists(p): return p
+    return shutil.which('ffmpeg')
+
+def get_ffprobe_path():
+    ff = get_ffmpeg_path()
+    if ff:
+        d = os.path.dirname(ff)
+        p = os.path.join(d, 'ffprobe.exe' if sys.platform == 'win32' else 'ffprobe')
+        if os.path.exists(p): return p
+    return shutil.which('ffprobe')
+
+def remove_readonly(func, path, _):
+    try:
+        os.chmod(path, stat.S_IWRITE)
+        func(path)
+    except Exception:
+        pass
+
+DEFAULT_WORKERS = max(1, min(32, os.cpu_count() or 1))
+
+def run_parallel(func, items, workers, should_stop=None, ordered=False):
+    """ items を workers 並列で func に渡し、(item, result, error) を順次返す。
+    投入数は workers*2 までに抑えるので、停止要求後は実行中の分だけ回収して終わる。
+    ordered=True なら投入順、False なら完了順に返す。 """
+    workers = max(1, int(workers))
+    it = iter(items)
+    pending = deque()
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        try:
+            while True:
+                while not exhausted and len(pending) < workers * 2:
+                    if should_stop and should_stop():
+                        exhausted = True
+                        break
+                    try:
+                        item = next(it)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.append((item, ex.submit(func, item)))
+                if not pending: break
+
+                if ordered:
+                    item, fut = pending.popleft()
+                else:
+                    done, _ = wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                    idx = next(i for i, (_, f) in enumerate(pending) if f in done)
+                    item, fut = pending[idx]
+                    del pending[idx]
+                try:
+                    yield item, fut.result(), None
+                except Exception as e:
+                    yield item, None, e
+        finally:
+            for _, f in pending: f.cancel()
+
+def prefetch(items, maxsize=1024, should_stop=None):
+    """ items を別スレッドで先読みし、最大 maxsize 件までキューにためて順に返す。
+    フォルダ走査 (生産側) と処理 (消費側) を並行させつつ、メモリ使用量は maxsize 件分で頭打ちになる。 """
+    q = queue.Queue(maxsize)
+    end = object()
+    cancelled = threading.Event()
+
+    def put(entry):
+        while not cancelled.is_set():
+            try:
+                q.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if (should_stop and should_stop()) or not put((item, None)): break
+            put((end, None))
+        except Exception as e:
+            put((end, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = q.get()
+            if item is end:
+                if error is not None: raise error
+                return
+            yield item
+    finally:
+        cancelled.set()
+
+# ==========================================
+# 🎬 FFMPEG RUNNER (停止・タイムアウト・進捗)
+# ==========================================
+FFMPEG_POLL_INTERVAL = 0.2  # 停止要求を確認する間隔 (秒)
+FFMPEG_STALL_TIMEOUT = 120  # 出力が進まなくなってから強制終了するまでの秒数
+
+class FFmpegCancelled(Exception):
+    """ 停止要求・タイムアウトで FFmpeg を強制終了した """
+
+def run_ffmpeg(cmd, should_stop=None, on_progress=None, stall_timeout=FFMPEG_STALL_TIMEOUT):
+    """ subprocess.run(cmd, check=True) の代わり。-progress pipe:1 の出力を別スレッドで読み、
+    進むたびに on_progress(出力済みバイト数, 出力済み時間[us]) を呼ぶ。
+    FFMPEG_POLL_INTERVAL ごとに should_stop() を確認し、停止要求か stall_timeout 秒以上出力が進まない場合は
+    プロセスを kill して FFmpegCancelled。異常終了は CalledProcessError (stderr の末尾付き) """
+    cmd = [cmd[0], '-nostdin', '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            creationflags=creation_flags)
+    last = [time.monotonic()]
+    err_tail = deque(maxlen=20)
+
+    def read_progress():
+        state, prev = {}, None
+        for raw in proc.stdout:
+            key, _, value = raw.decode('utf-8', 'replace').strip().partition('=')
+            state[key] = value
+            if key != 'progress': continue  # 1 ブロック (key=value の並び) の終わり
+            try: cur = (int(state.get('total_size') or 0), int(state.get('out_time_us') or 0))
+            except ValueError: continue
+            if cur != prev:
+                prev, last[0] = cur, time.monotonic()
+                if on_progress: on_progress(*cur)
+
+    def read_stderr():
+        for raw in proc.stderr: err_tail.append(raw.decode('utf-8', 'replace').rstrip())
+
+    readers = [threading.Thread(target=read_progress, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for t in readers: t.start()
+    try:
+        while True:
+            try:
+                proc.wait(FFMPEG_POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if should_stop and should_stop(): reason = "stopped"
+            elif stall_timeout and time.monotonic() - last[0] > stall_timeout: reason = f"no progress for {stall_timeout}s"
+            else: continue
+            raise FFmpegCancelled(reason)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        for t in readers: t.join(1)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd[0], stderr="\n".join(err_tail))
+
+def get_cache_dir():
+    """ ユーザーごとのキャッシュフォルダ (Windows: %LOCALAPPDATA%, その他: ~/.cache) """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'MetadataScanClean')
+
+def norm_path(path):
+    return os.path.normcase(os.path.abspath(path))
+
+class ScanIndex:
+    """ スキャン結果の永続キャッシュ。(path, size, mtime_ns) が一致するファイルは再解析しない。 """
+    SCHEMA = 6  # 判定ロジックを変更したら上げる（古い結果は破棄される）
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.path.join(get_cache_dir(), 'scan_index.sqlite3')
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                              "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, meta TEXT)")
+            row = self.conn.execute("SELECT value FROM info WHERE key='schema'").fetchone()
+            if row is None or row[0] != str(self.SCHEMA):
+                self.conn.execute("DELETE FROM files")
+                self.conn.execute("INSERT OR REPLACE INTO info VALUES ('schema', ?)", (str(self.SCHEMA),))
+
+    @staticmethod
+    def _prefix_range(folder):
+        prefix = os.path.join(norm_path(folder), '')
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    def load(self, folder):
+        """ folder 配下の登録済みエントリを {path: (size, mtime_ns, meta)} で返す """
+        lo, hi = self._prefix_range(folder)
+        with self.lock:
+            rows = self.conn.execute("SELECT path, size, mtime_ns, meta FROM files "
+                                     "WHERE path >= ? AND path < ?", (lo, hi)).fetchall()
+        known = {}
+        for path, size, mtime_ns, meta in rows:
+            try: known[path] = (size, mtime_ns, json.loads(meta))
+            except ValueError: pass
+        return known
+
+    def get(self, path):
+        """ 1 件だけ (size, mtime_ns, meta) で返す。無ければ None """
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, meta FROM files WHERE path = ?", (norm_path(path),)).fetchone()
+        if row is None: return None
+        try: return row[0], row[1], json.loads(row[2])
+        except ValueError: return None
+
+    def put_many(self, rows):
+        """ rows: [(path, size, mtime_ns, meta), ...] """
+        if not rows: return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                  [(p, sz, mt, json.dumps(m)) for p, sz, mt, m in rows])
+
+    def remove_many(self, paths):
+        if not paths: return
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in paths])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# ==========================================
+# 🖼 HEADER-ONLY IMAGE SCANNER (JPEG / PNG)
+# 画素データ (SOS / IDAT) の手前までのマーカー・チャンクだけを読む
+# ==========================================
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+TIFF_TAG_ARTIST, TIFF_TAG_COPYRIGHT, TIFF_TAG_ORIENTATION = 315, 33432, 274
+TIFF_TAG_EXIF_IFD, TIFF_TAG_GPS_IFD, EXIF_TAG_USER_COMMENT = 34665, 34853, 37510
+JPEG_SOS, JPEG_EOI, JPEG_APP1, JPEG_APP13, JPEG_COM = 0xDA, 0xD9, 0xE1, 0xED, 0xFE
+EXIF_HEADER = b'Exif\0\0'
+XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\0'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_LIMIT = 1 << 20  # 圧縮テキストを展開する上限
+PNG_SCAN_CHUNK_BYTES = 1 << 16  # スキャン時に読むチャンクの上限 (JPEG の 1 セグメントと同じ。ComfyUI の巨大な JSON は読まない)
+# PNG 標準キーワードのうち個人情報にあたるもの
+PNG_AUTHOR_KEYS = {'author', 'copyright'}
+XMP_GPS_MARKERS = (b'GPSLatitude', b'GPSLongitude')
+XMP_AUTHOR_MARKERS = (b'<dc:creator', b'<dc:rights', b'xmpRights:Owner', b'photoshop:Credit')
+# IPTC-IIM 2:80 By-line, 2:110 Credit, 2:116 Copyright Notice, 2:122 Writer/Editor
+IPTC_AUTHOR_DATASETS = {80, 110, 116, 122}
+
+def _tiff_ifd(data, offset, endian):
+    """ TIFF IFD のエントリを (tag, type, count, value_bytes) で列挙する """
+    if offset + 2 > len(data): return
+    count = struct.unpack(endian + 'H', data[offset:offset + 2])[0]
+    for i in range(count):
+        e = offset + 2 + i * 12
+        if e + 12 > len(data): return
+        tag, typ, n = struct.unpack(endian + 'HHI', data[e:e + 8])
+        size = TIFF_TYPE_SIZES.get(typ, 1) * n
+        if size <= 4:
+            value = data[e + 8:e + 8 + size]
+        else:
+            ptr = struct.unpack(endian + 'I', data[e + 8:e + 12])[0]
+            value = data[ptr:ptr + size]
+        yield tag, typ, n, value
+
+def _tiff_int(value, typ, endian):
+    if typ == 3: return struct.unpack(endian + 'H', value[:2])[0]
+    if typ in (4, 13): return struct.unpack(endian + 'I', value[:4])[0]
+    return value[0] if value else 0
+
+def parse_exif(data):
+    """ TIFF 形式の Exif を {'0th': {...}, 'Exif': {...}, 'GPS': {...}} に分解 (値は生バイト) """
+    if data.startswith(EXIF_HEADER): data = data[6:]
+    if data[:4] not in (b'II*\0', b'MM\0*'): return {}
+    endian = '<' if data[:2] == b'II' else '>'
+    ifd0 = struct.unpack(endian + 'I', data[4:8])[0]
+    result = {'0th': {}, 'Exif': {}, 'GPS': {}}
+    for tag, typ, n, value in _tiff_ifd(data, ifd0, endian):
+        result['0th'][tag] = value
+        if tag in (TIFF_TAG_EXIF_IFD, TIFF_TAG_GPS_IFD):
+            name = 'Exif' if tag == TIFF_TAG_EXIF_IFD else 'GPS'
+            for t2, _typ2, _n2, v2 in _tiff_ifd(data, _tiff_int(value, typ, endian), endian):
+                result[name][t2] = v2
+        elif tag == TIFF_TAG_ORIENTATION:
+            result['orientation'] = _tiff_int(value, typ, endian)
+    return result
+
+def exif_orientation(data):
+    """ Exif の Orientation (1〜8)。無ければ 1 """
+    try: return parse_exif(data).get('orientation', 1)
+    except struct.error: return 1
+
+# ==========================================
+# 🤖 AI GENERATION DETECTOR
+# ComfyUI / A1111 のプロンプト・ワークフローは数 MB になるので、キー名と先頭・末尾の一部だけで判定する
+# ==========================================
+# ComfyUI (prompt / workflow)、A1111 (parameters) が書き込むキー名 (PNG テキスト、Vorbis comment 等)
+AI_TAG_KEYS = {'prompt', 'workflow', 'parameters'}
+AI_SNIFF_CHARS = 4096  # 値を調べる範囲 (先頭・末尾それぞれ)
+# ComfyUI の JSON (VHS_VideoCombine の comment も同じ)、A1111 の parameters (末尾に Steps / Sampler / CFG scale)
+AI_TEXT_MARKERS = ('workflow', 'prompt', 'class_type', 'sampler:', 'cfg scale:')
+
+def is_ai_text(value):
+    """ 値 (str / bytes) の先頭・末尾 AI_SNIFF_CHARS だけを見て、AI 生成情報らしいかを判定する """
+    if len(value) > AI_SNIFF_CHARS * 2: value = value[:AI_SNIFF_CHARS] + value[-AI_SNIFF_CHARS:]
+    if isinstance(value, bytes): value = value.decode('latin-1')
+    t = value.lower()
+    return any(m in t for m in AI_TEXT_MARKERS)
+
+def is_ai_tag(key, value):
+    """ タグ (キー, 値) が AI 生成情報か。prompt / workflow / parameters はキー名だけで判定し、値は読まない """
+    k = key.lower()
+    return k in AI_TAG_KEYS or (('comment' in k or 'description' in k) and is_ai_text(value))
+
+# ■■■ ノード種別の抽出 (任意): JSON を組み立てずに正規表現だけで数える ■■■
+# API 形式 (prompt) の class_type と UI 形式 (workflow) のノード {"id": N, "type": ...}。
+# VHS の comment のように JSON が文字列として埋め込まれている場合 (\" でエスケープ) にも一致する
+AI_NODE_RE = re.compile(
+    rb'\\*"class_type\\*"\s{0,16}:\s{0,16}\\*"([^"\\]{1,200})\\*"'
+    rb'|\{\s{0,16}\\*"id\\*"\s{0,16}:\s{0,16}-?\d{1,12}\s{0,16},\s{0,16}\\*"type\\*"\s{0,16}:\s{0,16}\\*"([^"\\]{1,200})\\*"')
+AI_NODE_OVERLAP = 512  # チャンクの境目をまたぐ一致のために残す長さ (1 回の一致より長く)
+
+def count_ai_nodes(chunks):
+    """ bytes の反復 (ファイルを少しずつ読んだもの) からノード種別を数えて Counter で返す。
+    prompt と workflow の両方があれば、同じノードを二重に数えないよう prompt (API 形式) 側を返す """
+    api, ui = Counter(), Counter()
+    def add(m):
+        if m.group(1): api[m.group(1).decode('utf-8', 'replace')] += 1
+        else: ui[m.group(2).decode('utf-8', 'replace')] += 1
+    buf = b''
+    for chunk in chunks:
+        buf += chunk
+        end = len(buf) - AI_NODE_OVERLAP
+        if end <= 0: continue
+        done = 0
+        for m in AI_NODE_RE.finditer(buf):
+            if m.start() >= end: break  # 次のチャンクとつなげてから数える
+            add(m)
+            done = m.end()
+        buf = buf[max(done, end):]
+    for m in AI_NODE_RE.finditer(buf): add(m)
+    return api or ui
+
+def _png_text_stream(f, ctype, size):
+    """ テキストチャンクの値を COPY_CHUNK ずつ返す (圧縮されていれば少しずつ展開する) """
+    remaining = size
+    head = f.read(min(size, 512))
+    remaining -= len(head)
+    keyword, _, rest = head.partition(b'\0')
+    compressed = ctype == b'zTXt'
+    if ctype == b'zTXt':
+        rest = rest[1:]
+    elif ctype == b'iTXt':
+        # 言語タグ・翻訳キーワードは短い前提 (先頭 512 バイトに収まらなければ諦める)
+        compressed = rest[:1] == b'\x01'
+        parts = rest[2:].split(b'\0', 2)
+        if len(parts) < 3: return
+        rest = parts[2]
+    d = zlib.decompressobj() if compressed else None
+    while True:
+        if rest: yield d.decompress(rest) if d else rest
+        if remaining <= 0: break
+        rest = f.read(min(remaining, COPY_CHUNK))
+        if not rest: break
+        remaining -= len(rest)
+
+def png_ai_nodes(path):
+    """ PNG の prompt (無ければ workflow) チャンクからノード種別を数える。チャンクは少しずつ読む """
+    with open(path, 'rb') as f:
+        if f.read(8) != PNG_SIGNATURE: raise ValueError("not PNG")
+        found = {}
+        while True:
+            hdr = f.read(8)
+            if len(hdr) < 8: break
+            size, ctype = struct.unpack('>I4s', hdr)
+            if ctype in (b'IDAT', b'IEND'): break
+            start = f.tell()
+            if ctype in (b'tEXt', b'zTXt', b'iTXt'):
+                key = f.read(80).partition(b'\0')[0].decode('latin-1').lower()
+                f.seek(start)
+                if key in ('prompt', 'workflow') and key not in found:
+                    found[key] = count_ai_nodes(_png_text_stream(f, ctype, size))
+                    if key == 'prompt' and found[key]: break
+            f.seek(start + size + 4)  # CRC
+    return found.get('prompt') or found.get('workflow') or Counter()
+
+def tags_ai_nodes(tags):
+    """ 読み取り済みのタグ (動画・音声) からノード種別を数える """
+    values = [v for k, v in tags.items() if isinstance(v, str) and is_ai_tag(k, v)]
+    return count_ai_nodes(v[i:i + COPY_CHUNK].encode('utf-8') for v in values for i in range(0, len(v), COPY_CHUNK))
+
+def _classify_exif(data, info):
+    exif = parse_exif(data)
+    if exif.get('GPS'): info['has_gps'] = True
+    if any(k in exif.get('0th', {}) for k in (TIFF_TAG_ARTIST, TIFF_TAG_COPYRIGHT)): info['has_author'] = True
+    comment = exif.get('Exif', {}).get(EXIF_TAG_USER_COMMENT)
+    if comment and is_ai_text(comment[8:].replace(b'\0', b'')): info['has_ai'] = True
+
+def _classify_xmp(data, info):
+    if any(m in data for m in XMP_GPS_MARKERS): info['has_gps'] = True
+    if any(m in data for m in XMP_AUTHOR_MARKERS): info['has_author'] = True
+    if b'trainedAlgorithmicMedia' in data: info['has_ai'] = True
+
+def _classify_iptc(data, info):
+    """ APP13 (Photoshop 3.0 / 8BIM) 内の IPTC-IIM を走査 """
+    pos = data.find(b'\x1c\x02')
+    while 0 <= pos and pos + 5 <= len(data):
+        if data[pos] != 0x1c: break
+        dataset, size = data[pos + 2], struct.unpack('>H', data[pos + 3:pos + 5])[0]
+        if data[pos + 1] == 2 and dataset in IPTC_AUTHOR_DATASETS: info['has_author'] = True
+        pos += 5 + size
+
+def iter_jpeg_segments(f):
+    """ SOS までの (marker, payload) を返す """
+    if f.read(2) != b'\xff\xd8': raise ValueError("not JPEG")
+    while True:
+        b = f.read(1)
+        if not b: return
+        if b != b'\xff': continue
+        marker = f.read(1)
+        while marker == b'\xff': marker = f.read(1)
+        if not marker: return
+        m = marker[0]
+        if m in (JPEG_SOS, JPEG_EOI): return
+        if m == 0x01 or 0xD0 <= m <= 0xD7: continue
+        size = struct.unpack('>H', f.read(2))[0]
+        yield m, f.read(size - 2)
+
+def iter_png_chunks(f, stop_at_idat=True, limit=None, skip=()):
+    """ 最初の IDAT までの (type, data) を返す。limit を指定すると各チャンクの先頭 limit バイトだけを読む。
+    skip に含まれる種類のチャンクは読まずに (type, b'') を返す """
+    if f.read(8) != PNG_SIGNATURE: raise ValueError("not PNG")
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8: return
+        size, ctype = struct.unpack('>I4s', hdr)
+        if (stop_at_idat and ctype == b'IDAT') or ctype == b'IEND': return
+        data = b'' if ctype in skip else f.read(size if limit is None else min(size, limit))
+        f.seek(size - len(data) + 4, os.SEEK_CUR)  # 残り + CRC
+        yield ctype, data
+
+def png_text_chunk(ctype, data, limit=PNG_TEXT_LIMIT):
+    """ tEXt / zTXt / iTXt を (keyword, text) に。圧縮テキストは limit までしか展開しない """
+    keyword, _, rest = data.partition(b'\0')
+    key = keyword.decode('latin-1')
+    if ctype == b'tEXt':
+        return key, rest.decode('latin-1', 'replace')
+    if ctype == b'zTXt':
+        return key, zlib.decompressobj().decompress(rest[1:], limit).decode('latin-1', 'replace')
+    # iTXt: 圧縮フラグ, 圧縮方式, 言語タグ\0, 翻訳キーワード\0, テキスト
+    compressed = rest[:1] == b'\x01'
+    _lang, _, rest = rest[2:].partition(b'\0')
+    _tkey, _, text = rest.partition(b'\0')
+    if compressed: text = zlib.decompressobj().decompress(text, limit)
+    return key, text.decode('utf-8', 'replace')
+
+def scan_image_header(path):
+    """ JPEG/PNG の GPS・著作者・AI 生成情報の有無を、ヘッダ部分だけから判定する。
+    has_meta はスマート削除で取り除く部分 (jpeg_keeps_segment で残らないセグメント / PNG_KEEP_CHUNKS 以外のチャンク) があるか。
+    PNG は IDAT の後ろのチャンクも見る (IDAT はヘッダだけ読んで飛ばす) """
+    info = {'has_gps': False, 'has_author': False, 'has_ai': False, 'has_meta': False}
+    ext = os.path.splitext(path)[1].lower()
+    # PNG は IDAT を飛ばしながらチャンクヘッダ (8 バイト) だけを読むので、バッファなしで開く
+    # (バッファありだとシークのたびに 8KB 先読みし、IDAT が細かいファイルでは全体を読むのと変わらない)
+    with open(path, 'rb', buffering=0 if ext == '.png' else -1) as f:
+        if ext == '.png':
+            for ctype, data in iter_png_chunks(f, False, PNG_SCAN_CHUNK_BYTES, (b'IDAT', b'fdAT')):
+                if ctype not in PNG_KEEP_CHUNKS: info['has_meta'] = True
+                if ctype == b'eXIf':
+                    _classify_exif(data, info)
+                elif ctype in (b'tEXt', b'zTXt', b'iTXt'):
+                    # キー名で決まるもの (著作者・ComfyUI・A1111) は値を展開しない
+                    key = data.partition(b'\0')[0].decode('latin-1')
+                    if key.lower() in PNG_AUTHOR_KEYS: info['has_author'] = True
+                    elif key.lower() in AI_TAG_KEYS: info['has_ai'] = True
+                    elif key == 'XML:com.adobe.xmp':
+                        _classify_xmp(png_text_chunk(ctype, data)[1].encode('utf-8'), info)
+                    elif is_ai_text(png_text_chunk(ctype, data, AI_SNIFF_CHARS)[1]): info['has_ai'] = True
+        else:
+            for marker, data in iter_jpeg_segments(f):
+                if not jpeg_keeps_segment(marker, data): info['has_meta'] = True
+                if marker == JPEG_APP1 and data.startswith(EXIF_HEADER): _classify_exif(data, info)
+                elif marker == JPEG_APP1 and data.startswith(XMP_HEADER): _classify_xmp(data, info)
+                elif marker == JPEG_APP13: _classify_iptc(data, info)
+                elif marker == JPEG_COM and is_ai_text(data): info['has_ai'] = True
+    return info
+
+HEADER_SCAN_EXTS = {'.jpg', '.jpeg', '.png'}
+
+# ==========================================
+# ✂ NATIVE METADATA STRIPPER
+# ファイル構造だけを書き換え、画素・音声データはそのままコピーする
+# ==========================================
+COPY_CHUNK = 1 << 20
+# APPn は表示に必要なもの (JFIF/APP0・ICC プロファイル/APP2・Adobe の色変換/APP14) だけを残す。
+# Exif/XMP (APP1)・IPTC (APP13)・C2PA/JUMBF (APP11)・MPF やメーカー独自の APPn・コメント (COM) はすべて削除
+JPEG_KEEP_APP = {0xE0: b'', 0xE2: b'ICC_PROFILE\0', 0xEE: b'Adobe'}
+
+def jpeg_keeps_segment(marker, payload):
+    """ スマート削除でそのまま残すセグメントか (APPn・COM 以外の DQT / DHT / SOF 等は常に残す) """
+    if marker != JPEG_COM and not 0xE0 <= marker <= 0xEF: return True
+    sig = JPEG_KEEP_APP.get(marker)
+    return sig is not None and payload.startswith(sig)
+# 画像の表示に必要なチャンク (色・透過・解像度・APNG のアニメーション) だけを残す。
+# テキスト (AI プロンプト含む)・Exif・更新日時・未知の独自チャンク (caBX 等) はすべて削除
+PNG_KEEP_CHUNKS = {b'IHDR', b'PLTE', b'IDAT', b'IEND', b'tRNS', b'gAMA', b'cHRM', b'sRGB', b'iCCP', b'sBIT',
+                   b'pHYs', b'bKGD', b'acTL', b'fcTL', b'fdAT'}
+
+def _copy_bytes(fi, fo, n):
+    while n > 0:
+        buf = fi.read(min(n, COPY_CHUNK))
+        if not buf: raise ValueError("unexpected end of file")
+        fo.write(buf)
+        n -= len(buf)
+
+def copy_range(fi, fo, offset, length):
+    """ fi の [offset, offset+length) を fo の現在位置へコピーする。
+    copy_file_range → sendfile の順でカーネル内コピーを試し、使えなければ通常の読み書き。 """
+    fo.flush()
+    in_fd, out_fd = fi.fileno(), fo.fileno()
+    out_pos = fo.tell()
+    done = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while done < length:
+                n = os.copy_file_range(in_fd, out_fd, length - done, offset + done, out_pos + done)
+                if n == 0: break
+                done += n
+        except OSError:
+            pass
+    if done < length and hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+        try:
+            os.lseek(out_fd, out_pos + done, os.SEEK_SET)
+            while done < length:
+                n = os.sendfile(out_fd, in_fd, offset + done, length - done)
+                if n == 0: break
+                done += n
+        except OSError:
+            pass
+    fo.seek(out_pos + done)
+    if done < length:
+        fi.seek(offset + done)
+        _copy_bytes(fi, fo, length - done)
+
+FICLONE = 0x40049409  # Linux ioctl: ファイル全体の reflink (Btrfs / XFS / bcachefs 等)
+
+def clone_file(src, dst):
+    """ 中身だけをコピーする。reflink → copy_file_range / sendfile → 通常コピーの順に試す。
+    Linux 以外は shutil.copyfile (macOS は fcopyfile、Windows は大きめのバッファ) に任せる。 """
+    if not sys.platform.startswith('linux'): return shutil.copyfile(src, dst)
+    with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+        if fcntl:
+            try:
+                fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+                return dst
+            except OSError:
+                pass
+        copy_range(fi, fo, 0, os.fstat(fi.fileno()).st_size)
+    return dst
+
+def reflink_file(src, dst):
+    """ reflink だけを試す (データは複製しない)。対応していなければ dst を残さずに False """
+    if not (fcntl and sys.platform.startswith('linux')): return False
+    try:
+        with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+            fcntl.ioctl(fo.fileno(), FICLONE, fi.fileno())
+        return True
+    except OSError:
+        try: os.remove(dst)
+        except OSError: pass
+        return False
+
+def temp_output(dst):
+    """ dst を書き出すときの一時ファイル (同じフォルダの temp_<名前>)。書き終えてから os.replace で置き換えるので、
+    途中で落ちても dst に書きかけのファイルは残らない """
+    d_name, b_name = os.path.split(dst)
+    return os.path.join(d_name, f"temp_{b_name}")
+
+def fast_copy(src, dst):
+    """ shutil.copy2 の代わり (中身は clone_file、更新日時・権限は copystat) """
+    clone_file(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+def build_orientation_exif(orientation):
+    """ IFD0 に Orientation だけを持つ最小の Exif (APP1 ペイロード) """
+    return (EXIF_HEADER + b'MM\0*' + struct.pack('>IH', 8, 1)
+            + struct.pack('>HHIHH', TIFF_TAG_ORIENTATION, 3, 1, orientation, 0) + struct.pack('>I', 0))
+
+def strip_jpeg(src, dst):
+    """ JPEG を 1 回の読み書きでコピーしつつメタデータセグメントを落とす。
+    Orientation (274) のみ最小の Exif として残し、SOS 以降の圧縮データには一切触れない。 """
+    with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+        if fi.read(2) != b'\xff\xd8': raise ValueError("not JPEG")
+        fo.write(b'\xff\xd8')
+        while True:
+            marker = fi.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF: raise ValueError("broken JPEG marker")
+            while marker[1] == 0xFF:  # フィルバイト
+                marker = marker[1:] + fi.read(1)
+            m = marker[1]
+            if m == JPEG_SOS or m == JPEG_EOI:
+                # 以降 (エントロピー符号化データ) はそのままコピー
+                fo.write(marker)
+                pos = fi.tell()
+                copy_range(fi, fo, pos, os.fstat(fi.fileno()).st_size - pos)
+                return True
+            if m == 0x01 or 0xD0 <= m <= 0xD7:
+                fo.write(marker)
+                continue
+            raw_len = fi.read(2)
+            if len(raw_len) < 2: raise ValueError("truncated JPEG")
+            payload = fi.read(struct.unpack('>H', raw_len)[0] - 2)
+            if jpeg_keeps_segment(m, payload):
+                fo.write(marker + raw_len + payload)
+            elif m == JPEG_APP1 and payload.startswith(EXIF_HEADER):
+                orientation = parse_exif(payload).get('orientation')
+                if orientation:
+                    exif = build_orientation_exif(orientation)
+                    fo.write(b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif)
+
+def strip_png(src, dst):
+    """ PNG をチャンク単位でコピーし PNG_KEEP_CHUNKS 以外を落とす。IDAT は展開せずそのままコピーする。
+    eXIf に回転指定がある場合は向きを保てないので ValueError (再エンコードに任せる)。 """
+    with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+        if fi.read(8) != PNG_SIGNATURE: raise ValueError("not PNG")
+        fo.write(PNG_SIGNATURE)
+        while True:
+            hdr = fi.read(8)
+            if len(hdr) < 8: raise ValueError("truncated PNG")
+            size, ctype = struct.unpack('>I4s', hdr)
+            if ctype not in PNG_KEEP_CHUNKS:
+                if ctype == b'eXIf' and exif_orientation(fi.read(size)) != 1:
+                    raise ValueError("PNG needs rotation")
+                fi.seek(size + 4 - (size if ctype == b'eXIf' else 0), os.SEEK_CUR)
+                continue
+            fo.write(hdr)
+            _copy_bytes(fi, fo, size + 4)  # データ + CRC
+            if ctype == b'IEND': return True
+
+# WebP (RIFF): 画像データ・透過・アニメーション・ICC だけを残し (EXIF / XMP / 未知のチャンクは削除)、
+# VP8X のフラグを残したチャンクに合わせて書き直す
+WEBP_KEEP_CHUNKS = {b'VP8 ', b'VP8L', b'VP8X', b'ALPH', b'ANIM', b'ANMF', b'ICCP'}
+WEBP_FLAG_ICC, WEBP_FLAG_ALPHA, WEBP_FLAG_EXIF, WEBP_FLAG_XMP, WEBP_FLAG_ANIM = 0x20, 0x10, 0x08, 0x04, 0x02
+
+def strip_webp(src, dst):
+    """ WebP の RIFF チャンクを組み替える (再エンコードなし)。
+    Exif に回転指定があれば Orientation だけの Exif に置き換えて向きを保つ。 """
+    with open(src, 'rb') as fi:
+        hdr = fi.read(12)
+        if len(hdr) < 12 or hdr[:4] != b'RIFF' or hdr[8:12] != b'WEBP': raise ValueError("not WebP")
+        fi.seek(0, os.SEEK_END)
+        riff_end = min(fi.tell(), 8 + struct.unpack('<I', hdr[4:8])[0])
+        chunks = []  # (fourcc, データ位置, サイズ, 置き換えデータ)
+        orientation = None
+        pos = 12
+        while pos + 8 <= riff_end:
+            fi.seek(pos)
+            fourcc, size = struct.unpack('<4sI', fi.read(8))
+            if pos + 8 + size > riff_end: raise ValueError("truncated WebP chunk")
+            if fourcc == b'EXIF':
+                orientation = exif_orientation(fi.read(size))
+            elif fourcc in WEBP_KEEP_CHUNKS:
+                chunks.append((fourcc, pos + 8, size, None))
+            pos += 8 + size + (size & 1)
+
+        has_vp8x = bool(chunks) and chunks[0][0] == b'VP8X'
+        if orientation and orientation != 1 and has_vp8x:
+            chunks.append((b'EXIF', None, None, build_orientation_exif(orientation)[len(EXIF_HEADER):]))
+        riff_size = 4 + sum(8 + (len(d) if d is not None else n) + ((len(d) if d is not None else n) & 1)
+                            for _, _, n, d in chunks)
+
+        with open(dst, 'wb') as fo:
+            fo.write(b'RIFF' + struct.pack('<I', riff_size) + b'WEBP')
+            for fourcc, data_pos, size, data in chunks:
+                if data is not None:
+                    fo.write(fourcc + struct.pack('<I', len(data)) + data + b'\0' * (len(data) & 1))
+                    continue
+                fi.seek(data_pos)
+                if fourcc == b'VP8X':
+                    # 透過フラグは元のまま、ICC / Exif / アニメーションは実際に残したチャンクから決める (XMP は常に無し)
+                    body = bytearray(fi.read(size))
+                    kept = {c[0] for c in chunks}
+                    body[0] = ((body[0] & WEBP_FLAG_ALPHA) | (WEBP_FLAG_ICC if b'ICCP' in kept else 0)
+                               | (WEBP_FLAG_EXIF if b'EXIF' in kept else 0) | (WEBP_FLAG_ANIM if b'ANIM' in kept else 0))
+                    fo.write(fourcc + struct.pack('<I', size) + bytes(body) + b'\0' * (size & 1))
+                else:
+                    fo.write(fourcc + struct.pack('<I', size))
+                    _copy_bytes(fi, fo, size + (size & 1))
+    return True
+
+# TIFF: 画像の復号に必要なタグだけを残して IFD を書き直し、ストリップ/タイルはそのままコピーする
+# (Artist/Copyright/DateTime/Make/Model/XMP/IPTC/Photoshop/Exif IFD/GPS IFD などは残らない)
+TIFF_KEEP_TAGS = {
+    254, 255, 256, 257, 258, 259, 262, 263, 264, 265, 266, 273, 274, 277, 278, 279, 280, 281,
+    282, 283, 284, 290, 291, 292, 293, 296, 297, 301, 317, 318, 319, 320, 321, 322, 323, 324,
+    325, 332, 334, 338, 339, 340, 341, 347, 529, 530, 531, 532, 34675,
+}
+TIFF_DATA_TAGS = {273: 279, 324: 325}  # StripOffsets/StripByteCounts, TileOffsets/TileByteCounts
+TIFF_MAX_PAGES = 10000
+
+def _tiff_read_ifd(fi, offset, endian):
+    """ IFD を読み、残すタグだけを {tag: (type, count, value_bytes)} で返す """
+    fi.seek(offset)
+    raw = fi.read(2)
+    if len(raw) < 2: raise ValueError("bad IFD offset")
+    n = struct.unpack(endian + 'H', raw)[0]
+    raw = fi.read(12 * n + 4)
+    if len(raw) < 12 * n + 4: raise ValueError("truncated IFD")
+    entries = {}
+    for i in range(n):
+        tag, typ, count = struct.unpack(endian + 'HHI', raw[12 * i:12 * i + 8])
+        if tag not in TIFF_KEEP_TAGS: continue
+        if typ not in TIFF_TYPE_SIZES: raise ValueError(f"unknown TIFF type {typ}")
+        nbytes = TIFF_TYPE_SIZES[typ] * count
+        field = raw[12 * i + 8:12 * i + 12]
+        if nbytes <= 4:
+            value = field[:nbytes]
+        else:
+            fi.seek(struct.unpack(endian + 'I', field)[0])
+            value = fi.read(nbytes)
+            if len(value) < nbytes: raise ValueError("truncated TIFF value")
+        entries[tag] = (typ, count, value)
+    return entries, struct.unpack(endian + 'I', raw[-4:])[0]
+
+def _tiff_uints(typ, count, value, endian):
+    if typ == 3: return list(struct.unpack(f"{endian}{count}H", value))
+    if typ in (4, 13): return list(struct.unpack(f"{endian}{count}I", value))
+    raise ValueError("unexpected offset type")
+
+def _pad_even(fo):
+    if fo.tell() & 1: fo.write(b'\0')
+
+def strip_tiff(src, dst):
+    """ TIFF の IFD チェーンを必要なタグだけで書き直す。ストリップ/タイルのデータは復号せずそのままコピーする。 """
+    with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+        head = fi.read(8)
+        if head[:4] not in (b'II*\0', b'MM\0*'): raise ValueError("not classic TIFF")
+        endian = '<' if head[:2] == b'II' else '>'
+        offset = struct.unpack(endian + 'I', head[4:8])[0]
+        fo.write(head[:4] + b'\0\0\0\0')
+        link_pos = 4  # 次の IFD の位置を書き込む場所
+        seen = set()
+        while offset:
+            if offset in seen or len(seen) >= TIFF_MAX_PAGES: raise ValueError("IFD loop")
+            seen.add(offset)
+            entries, next_offset = _tiff_read_ifd(fi, offset, endian)
+            if 259 in entries and _tiff_uints(*entries[259], endian)[0] == 6:
+                raise ValueError("old-style JPEG TIFF")  # JPEGInterchangeFormat を辿る必要がある
+
+            for off_tag, cnt_tag in TIFF_DATA_TAGS.items():
+                if off_tag not in entries: continue
+                if cnt_tag not in entries: raise ValueError("missing byte counts")
+                offsets = _tiff_uints(*entries[off_tag], endian)
+                counts = _tiff_uints(*entries[cnt_tag], endian)
+                if len(offsets) != len(counts): raise ValueError("offset/count mismatch")
+                new_offsets = []
+                for o, c in zip(offsets, counts):
+                    _pad_even(fo)
+                    new_offsets.append(fo.tell())
+                    fi.seek(o)
+                    _copy_bytes(fi, fo, c)
+                entries[off_tag] = (4, len(new_offsets), struct.pack(f"{endian}{len(new_offsets)}I", *new_offsets))
+
+            fields = []
+            for tag in sorted(entries):
+                typ, count, value = entries[tag]
+                if len(value) > 4:
+                    _pad_even(fo)
+                    field = struct.pack(endian + 'I', fo.tell())
+                    fo.write(value)
+                else:
+                    field = value.ljust(4, b'\0')
+                fields.append(struct.pack(endian + 'HHI', tag, typ, count) + field)
+            _pad_even(fo)
+            ifd_pos = fo.tell()
+            fo.write(struct.pack(endian + 'H', len(fields)) + b''.join(fields) + b'\0\0\0\0')
+            fo.seek(link_pos)
+            fo.write(struct.pack(endian + 'I', ifd_pos))
+            fo.seek(0, os.SEEK_END)
+            link_pos = ifd_pos + 2 + 12 * len(fields)
+            offset = next_offset
+        if link_pos == 4: raise ValueError("no IFD")
+    return True
+
+IMAGE_STRIPPERS = {'.jpg': strip_jpeg, '.jpeg': strip_jpeg, '.png': strip_png,
+                   '.webp': strip_webp, '.tif': strip_tiff, '.tiff': strip_tiff}
+
+# ==========================================
+# 🧮 BOUNDED-MEMORY RE-ENCODE
+# ==========================================
+MEM_LIMIT_MB = 1024  # ワーカー 1 つあたりの画像展開メモリの目安
+
+class MemoryBudget:
+    """ 画像の展開に使うメモリ量をワーカー全体で制限する。
+    空きが出るまで待たせるので、大きな画像が同時に展開されて OOM になるのを防ぐ。
+    上限より大きい 1 枚は、他の展開が終わってから単独で処理される。 """
+    def __init__(self, limit_bytes):
+        self.limit = max(1, int(limit_bytes))
+        self.used = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, n):
+        n = min(max(0, int(n)), self.limit)
+        with self.cond:
+            while self.used + n > self.limit: self.cond.wait()
+            self.used += n
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.used -= n
+                self.cond.notify_all()
+
+def estimate_image_bytes(img):
+    """ 展開後の画像 1 枚分のメモリ量 (Pillow は多バンド画像を 1 画素 4 バイトで持つ) """
+    if img.mode in ('1', 'L', 'P'): bpp = 1
+    elif img.mode.startswith('I;16'): bpp = 2
+    else: bpp = 4
+    return img.size[0] * img.size[1] * bpp
+
+def reencode_image(src, dst, budget=None):
+    """ 画素だけを新しい画像に移して保存する (Exif/XMP/ICC/テキスト等はすべて破棄)。
+    画素のコピーは Pillow 内部で行い、1 画素ごとの Python リストは作らない。
+    元画像と新画像の 2 枚分を budget から確保してから展開する。 """
+    ext = os.path.splitext(dst)[1].lower()
+    with Image.open(src) as img:
+        with (budget.reserve(estimate_image_bytes(img) * 2) if budget else nullcontext()):
+            pixels = img
+            if img.getexif().get(TIFF_TAG_ORIENTATION, 1) != 1:
+                pixels = ImageOps.exif_transpose(img)
+                img.close()  # 回転後のコピーだけを残す
+            clean = Image.new(pixels.mode, pixels.size)
+            if pixels.mode in ('P', 'PA'): clean.putpalette(pixels.getpalette())
+            clean.paste(pixels)
+            pixels.close()
+            del pixels
+
+            if ext == '.png': clean.save(dst, optimize=True)
+            elif ext in ['.jpg', '.jpeg']: clean.save(dst, quality=95)
+            else: clean.save(dst)
+            clean.close()
+    return True
+
+# ==========================================
+# 📦 NATIVE CONTAINER READER (MP4/MOV, Matroska/WebM)
+# ffprobe を起動せず、タグ部分だけをシークして読む
+# ==========================================
+MP4_EXTS = {'.mp4', '.mov', '.m4v', '.m4a', '.3gp'}
+MKV_EXTS = {'.mkv', '.webm', '.mka'}
+# スキャンで読むタグの値の上限。AI 判定 (is_ai_text) が見る先頭・末尾の分だけ読めば足りる
+TAG_SCAN_LIMIT = 2 * AI_SNIFF_CHARS
+
+def read_bounded(f, size, limit=None):
+    """ 現在位置から size バイト読む。limit を超える値は先頭・末尾 limit // 2 ずつだけ読んでつなぐ (間はシークで飛ばす) """
+    if limit is None or size <= limit: return f.read(size)
+    half = limit // 2
+    head = f.read(half)
+    f.seek(size - 2 * half, os.SEEK_CUR)
+    return head + f.read(half)
+
+# ffprobe (libavformat/mov.c) と同じキー名に揃える
+MP4_TAG_NAMES = {
+    b'\xa9nam': 'title', b'\xa9ART': 'artist', b'aART': 'album_artist', b'\xa9alb': 'album',
+    b'\xa9cmt': 'comment', b'\xa9day': 'date', b'\xa9gen': 'genre', b'gnre': 'genre',
+    b'\xa9too': 'encoder', b'\xa9enc': 'encoder', b'cprt': 'copyright', b'\xa9wrt': 'composer',
+    b'desc': 'description', b'ldes': 'synopsis', b'\xa9lyr': 'lyrics', b'trkn': 'track',
+    b'disk': 'disc', b'tvsh': 'show', b'tven': 'episode_id', b'tvnn': 'network',
+    b'\xa9grp': 'grouping', b'\xa9xyz': 'location', b'\xa9mak': 'make', b'\xa9mod': 'model',
+    b'\xa9aut': 'author', b'\xa9inf': 'comment', b'\xa9des': 'description',
+}
+MP4_XMP_UUID = bytes.fromhex('BE7ACFCB97A942E89C71999491E3AFAC')
+MP4_CONTAINERS = {b'moov', b'udta', b'trak', b'mdia', b'minf', b'stbl', b'ilst'}
+
+def _mp4_atoms(f, start, end):
+    """ [start, end) 内のアトムを (type, pos, header_len, size) で列挙 """
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        hdr = f.read(8)
+        if len(hdr) < 8: return
+        size, typ = struct.unpack('>I4s', hdr)
+        hlen = 8
+        if size == 1:
+            ext = f.read(8)
+            if len(ext) < 8: return
+            size = struct.unpack('>Q', ext)[0]
+            hlen = 16
+        elif size == 0:
+            size = end - pos
+        if size < hlen or pos + size > end:
+            raise ValueError(f"broken atom {typ!r} at {pos}")
+        yield typ, pos, hlen, size
+        pos += size
+
+def _mp4_meta_start(f, pos, hlen):
+    """ meta は ISO では FullBox、QuickTime では通常の Box。hdlr の位置で判別する """
+    f.seek(pos + hlen)
+    head = f.read(8)
+    return pos + hlen + (0 if head[4:8] == b'hdlr' else 4)
+
+def _mp4_data_value(f, typ, pos, hlen, size, limit=None):
+    """ ilst アイテム内の data アトムを文字列にする。バイナリ(カバー画像等)は None """
+    f.seek(pos + hlen)
+    head = f.read(8)
+    if len(head) < 8 or size - hlen < 8: return None
+    dtype = int.from_bytes(head[1:4], 'big')
+    if dtype not in (1, 2): limit = None  # 数値などは短い
+    body = read_bounded(f, size - hlen - 8, limit)
+    if dtype == 1: return body.decode('utf-8', 'replace')
+    if dtype == 2: return body.decode('utf-16-be', 'replace')
+    if dtype in (21, 22) and 0 < len(body) <= 8: return str(int.from_bytes(body, 'big', signed=(dtype == 21)))
+    if dtype == 0 and typ in (b'trkn', b'disk') and len(body) >= 6:
+        num, total = struct.unpack('>HH', body[2:6])
+        return f"{num}/{total}" if total else str(num)
+    if dtype == 0 and typ == b'gnre' and len(body) >= 2:
+        return str(struct.unpack('>H', body[:2])[0])
+    return None
+
+def _mp4_read_ilst(f, start, end, tags, keys=None, limit=None):
+    for typ, pos, hlen, size in _mp4_atoms(f, start, end):
+        name = None
+        if keys is not None:
+            idx = struct.unpack('>I', typ)[0]
+            if 0 < idx <= len(keys): name = keys[idx - 1]
+        elif typ == b'----':
+            # フリーフォーム: mean / name / data
+            for ctyp, cpos, chlen, csize in _mp4_atoms(f, pos + hlen, pos + size):
+                if ctyp == b'name':
+                    f.seek(cpos + chlen + 4)
+                    name = f.read(csize - chlen - 4).decode('utf-8', 'replace')
+        else:
+            name = MP4_TAG_NAMES.get(typ, typ.decode('latin-1').replace('\xa9', ''))
+        if not name: continue
+        for ctyp, cpos, chlen, csize in _mp4_atoms(f, pos + hlen, pos + size):
+            if ctyp != b'data': continue
+            v = _mp4_data_value(f, typ, cpos, chlen, csize, limit)
+            if v is not None: tags[name] = v
+            break
+
+def _mp4_read_meta(f, pos, hlen, size, tags, limit=None):
+    keys = None
+    start = _mp4_meta_start(f, pos, hlen)
+    children = list(_mp4_atoms(f, start, pos + size))
+    for ctyp, cpos, chlen, csize in children:
+        if ctyp == b'keys':
+            # QuickTime メタデータ (mdta): ilst のインデックス → キー名
+            f.seek(cpos + chlen + 4)
+            count = struct.unpack('>I', f.read(4))[0]
+            keys = []
+            for _ in range(count):
+                ksize, _ns = struct.unpack('>I4s', f.read(8))
+                keys.append(f.read(max(0, ksize - 8)).decode('utf-8', 'replace'))
+    for ctyp, cpos, chlen, csize in children:
+        if ctyp == b'ilst': _mp4_read_ilst(f, cpos + chlen, cpos + csize, tags, keys, limit)
+
+def _mp4_read_udta(f, start, end, tags, limit=None):
+    for typ, pos, hlen, size in _mp4_atoms(f, start, end):
+        if typ == b'meta':
+            _mp4_read_meta(f, pos, hlen, size, tags, limit)
+        elif typ == b'XMP_':
+            f.seek(pos + hlen)
+            tags['xmp'] = read_bounded(f, size - hlen, limit).decode('utf-8', 'replace')
+        elif typ == b'loci' and size - hlen >= 19:
+            # 3GPP 位置情報: FullBox, 言語, 地名(NUL終端), role, 経度, 緯度, 高度 (16.16 固定小数点)
+            f.seek(pos + hlen)
+            body = f.read(size - hlen)
+            end = body.find(b'\0', 6)
+            if end >= 0 and len(body) >= end + 14:
+                lon, lat, alt = struct.unpack('>iii', body[end + 2:end + 14])
+                loc = f"{lat / 65536:+08.4f}{lon / 65536:+09.4f}" + (f"{alt / 65536:+.4f}" if alt else "")
+                tags.setdefault('location', loc + "/")
+        elif typ[:1] == b'\xa9' and size - hlen >= 4:
+            # QuickTime 形式のテキストアトム (Android の ©xyz 位置情報など)
+            f.seek(pos + hlen)
+            strlen, _lang = struct.unpack('>HH', f.read(4))
+            if strlen and strlen <= size - hlen - 4:
+                name = MP4_TAG_NAMES.get(typ, typ[1:].decode('latin-1'))
+                tags.setdefault(name, read_bounded(f, strlen, limit).decode('utf-8', 'replace'))
+
+def read_mp4_tags(f, limit=None):
+    f.seek(0, os.SEEK_END)
+    file_end = f.tell()
+    tags = {}
+    found_moov = False
+    for typ, pos, hlen, size in _mp4_atoms(f, 0, file_end):
+        if typ == b'ftyp' and size - hlen >= 8:
+            f.seek(pos + hlen)
+            body = f.read(min(size - hlen, 256))
+            tags['major_brand'] = body[:4].decode('latin-1').strip()
+            tags['minor_version'] = str(struct.unpack('>I', body[4:8])[0])
+            tags['compatible_brands'] = body[8:].decode('latin-1')
+        elif typ == b'uuid' and size - hlen >= 16:
+            f.seek(pos + hlen)
+            if f.read(16) == MP4_XMP_UUID:
+                tags['xmp'] = read_bounded(f, size - hlen - 16, limit).decode('utf-8', 'replace')
+        elif typ == b'moov':
+            found_moov = True
+            for ctyp, cpos, chlen, csize in _mp4_atoms(f, pos + hlen, pos + size):
+                if ctyp == b'mvhd':
+                    f.seek(cpos + chlen)
+                    vf = f.read(20)
+                    ctime = struct.unpack('>Q', vf[4:12])[0] if vf[0] == 1 else struct.unpack('>I', vf[4:8])[0]
+                    if ctime:
+                        dt = datetime(1904, 1, 1) + timedelta(seconds=ctime)
+                        tags['creation_time'] = dt.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+                elif ctyp == b'udta':
+                    _mp4_read_udta(f, cpos + chlen, cpos + csize, tags, limit)
+                elif ctyp == b'meta':
+                    _mp4_read_meta(f, cpos, chlen, csize, tags, limit)
+    if not found_moov: raise ValueError("moov not found")
+    return tags
+
+# Matroska / EBML
+EBML_HEADER, EBML_DOCTYPE = 0x1A45DFA3, 0x4282
+MKV_SEGMENT, MKV_SEEKHEAD, MKV_SEEK, MKV_SEEK_ID, MKV_SEEK_POS = 0x18538067, 0x114D9B74, 0x4DBB, 0x53AB, 0x53AC
+MKV_INFO, MKV_TITLE, MKV_DATE = 0x1549A966, 0x7BA9, 0x4461
+MKV_CLUSTER, MKV_TAGS, MKV_TAG, MKV_TARGETS = 0x1F43B675, 0x1254C367, 0x7373, 0x63C0
+MKV_SIMPLETAG, MKV_TAGNAME, MKV_TAGLANG, MKV_TAGSTRING = 0x67C8, 0x45A3, 0x447A, 0x4487
+MKV_TARGET_UIDS = {0x63C5, 0x63C9, 0x63C4, 0x63C6}
+
+def _ebml_vint(f, is_id):
+    b = f.read(1)
+    if not b: raise EOFError
+    first, length, mask = b[0], 1, 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8: raise ValueError("bad EBML vint")
+    value = first if is_id else first & (mask - 1)
+    rest = f.read(length - 1)
+    if len(rest) < length - 1: raise EOFError
+    unknown = not is_id and value == mask - 1 and all(c == 0xFF for c in rest)
+    for c in rest: value = (value << 8) | c
+    return (None if unknown else value), length
+
+def _ebml_elements(f, start, end):
+    """ [start, end) 内の要素を (id, data_pos, size, elem_pos) で列挙。サイズ不明要素は size=None """
+    pos = start
+    while end is None or pos < end:
+        f.seek(pos)
+        try:
+            eid, l1 = _ebml_vint(f, True)
+            size, l2 = _ebml_vint(f, False)
+        except EOFError:
+            return
+        data = pos + l1 + l2
+        yield eid, data, size, pos
+        if size is None: return
+        pos = data + size
+
+def _ebml_read(f, pos, size, limit=None):
+    f.seek(pos)
+    return read_bounded(f, size, limit)
+
+def _ebml_uint(f, pos, size):
+    return int.from_bytes(_ebml_read(f, pos, size), 'big')
+
+def _mkv_read_simpletags(f, start, end, tags, prefix='', limit=None):
+    for eid, pos, size, _ in _ebml_elements(f, start, end):
+        if eid != MKV_SIMPLETAG or size is None: continue
+        name = lang = value = None
+        nested = False
+        for cid, cpos, csize, _ in _ebml_elements(f, pos, pos + size):
+            if csize is None: break
+            if cid == MKV_TAGNAME: name = _ebml_read(f, cpos, csize).decode('utf-8', 'replace')
+            elif cid == MKV_TAGLANG: lang = _ebml_read(f, cpos, csize).decode('latin-1')
+            elif cid == MKV_TAGSTRING: value = _ebml_read(f, cpos, csize, limit).decode('utf-8', 'replace')
+            elif cid == MKV_SIMPLETAG: nested = True
+        if not name: continue
+        key = prefix + name
+        if lang and lang != 'und': key += f"-{lang}"
+        if value is not None: tags[key] = value
+        if nested: _mkv_read_simpletags(f, pos, pos + size, tags, key + '/', limit)
+
+def _mkv_read_tags(f, start, end, tags, limit=None):
+    for eid, pos, size, _ in _ebml_elements(f, start, end):
+        if eid != MKV_TAG or size is None: continue
+        is_global = True
+        for cid, cpos, csize, _ in _ebml_elements(f, pos, pos + size):
+            if cid == MKV_TARGETS and csize is not None:
+                for tid, tpos, tsize, _ in _ebml_elements(f, cpos, cpos + csize):
+                    if tid in MKV_TARGET_UIDS and _ebml_uint(f, tpos, tsize): is_global = False
+        # トラック単位のタグは ffprobe では stream tags 扱いなので format tags には含めない
+        if is_global: _mkv_read_simpletags(f, pos, pos + size, tags, limit=limit)
+
+def _mkv_read_info(f, start, end, tags, limit=None):
+    for eid, pos, size, _ in _ebml_elements(f, start, end):
+        if size is None: break
+        if eid == MKV_TITLE:
+            tags['title'] = _ebml_read(f, pos, size, limit).decode('utf-8', 'replace')
+        elif eid == MKV_DATE and size == 8:
+            ns = struct.unpack('>q', _ebml_read(f, pos, 8))[0]
+            dt = datetime(2001, 1, 1) + timedelta(microseconds=ns // 1000)
+            tags['creation_time'] = dt.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+def read_mkv_tags(f, limit=None):
+    f.seek(0)
+    header = next(_ebml_elements(f, 0, None), None)
+    if not header or header[0] != EBML_HEADER or header[2] is None: raise ValueError("not EBML")
+    _, hpos, hsize, _ = header
+    doctype = b''
+    for cid, cpos, csize, _ in _ebml_elements(f, hpos, hpos + hsize):
+        if cid == EBML_DOCTYPE: doctype = _ebml_read(f, cpos, csize).rstrip(b'\0')
+    if doctype not in (b'matroska', b'webm'): raise ValueError(f"unknown doctype {doctype!r}")
+
+    segment = next(_ebml_elements(f, hpos + hsize, None), None)
+    if not segment or segment[0] != MKV_SEGMENT: raise ValueError("segment not found")
+    _, seg_pos, seg_size, _ = segment
+    seg_end = None if seg_size is None else seg_pos + seg_size
+
+    # クラスタ(メディア本体)の手前まで走査し、その先にある Tags/Info は SeekHead の位置へ直接シークする
+    starts = set()
+    for eid, pos, size, elem in _ebml_elements(f, seg_pos, seg_end):
+        if eid == MKV_CLUSTER or size is None: break
+        if eid in (MKV_TAGS, MKV_INFO):
+            starts.add(elem)
+        elif eid == MKV_SEEKHEAD:
+            for sid, spos, ssize, _ in _ebml_elements(f, pos, pos + size):
+                if sid != MKV_SEEK or ssize is None: continue
+                seek_id = seek_pos = None
+                for cid, cpos, csize, _ in _ebml_elements(f, spos, spos + ssize):
+                    if cid == MKV_SEEK_ID: seek_id = _ebml_uint(f, cpos, csize)
+                    elif cid == MKV_SEEK_POS: seek_pos = _ebml_uint(f, cpos, csize)
+                if seek_id in (MKV_TAGS, MKV_INFO) and seek_pos is not None:
+                    starts.add(seg_pos + seek_pos)
+
+    tags = {}
+    for start in sorted(starts):
+        for eid, pos, size, _ in _ebml_elements(f, start, None):
+            if size is None: break
+            if eid == MKV_TAGS: _mkv_read_tags(f, pos, pos + size, tags, limit)
+            elif eid == MKV_INFO: _mkv_read_info(f, pos, pos + size, tags, limit)
+            break
+    return tags
+
+# ==========================================
+# 🎵 NATIVE AUDIO TAG READER (ID3 / APEv2 / FLAC / Ogg Vorbis・Opus / RIFF INFO)
+# ==========================================
+ID3_EXTS = {'.mp3', '.aac'}
+AUDIO_TAG_EXTS = ID3_EXTS | {'.wav', '.flac', '.ogg', '.opus'}
+
+# ffprobe (libavformat/id3v2.c, riff.c) と同じキー名に揃える
+ID3_TAG_NAMES = {
+    'TALB': 'album', 'TCOM': 'composer', 'TCON': 'genre', 'TCOP': 'copyright', 'TENC': 'encoded_by',
+    'TIT2': 'title', 'TLAN': 'language', 'TPE1': 'artist', 'TPE2': 'album_artist', 'TPE3': 'performer',
+    'TPOS': 'disc', 'TPUB': 'publisher', 'TRCK': 'track', 'TSSE': 'encoder', 'TDRC': 'date',
+    'TDRL': 'date', 'TYER': 'date', 'TDEN': 'creation_time', 'TSOA': 'album-sort', 'TSOP': 'artist-sort',
+    'TSOT': 'title-sort', 'TCMP': 'compilation',
+    # ID3v2.2
+    'TAL': 'album', 'TCO': 'genre', 'TCP': 'compilation', 'TT2': 'title', 'TEN': 'encoded_by',
+    'TP1': 'artist', 'TP2': 'album_artist', 'TP3': 'performer', 'TRK': 'track', 'TYE': 'date',
+    'TCR': 'copyright', 'TSS': 'encoder', 'TPA': 'disc', 'TPB': 'publisher', 'TCM': 'composer',
+}
+RIFF_INFO_NAMES = {
+    b'IART': 'artist', b'ICMT': 'comment', b'ICOP': 'copyright', b'ICRD': 'date', b'IGNR': 'genre',
+    b'ILNG': 'language', b'INAM': 'title', b'IPRD': 'album', b'IPRT': 'track', b'ITRK': 'track',
+    b'ISBJ': 'subject', b'ISFT': 'encoder', b'ISMP': 'timecode', b'ITCH': 'encoded_by',
+}
+VORBIS_TAG_NAMES = {'ALBUMARTIST': 'album_artist', 'TRACKNUMBER': 'track', 'DISCNUMBER': 'disc', 'DESCRIPTION': 'comment'}
+ID3_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+def _synchsafe(b):
+    return (b[0] & 0x7f) << 21 | (b[1] & 0x7f) << 14 | (b[2] & 0x7f) << 7 | (b[3] & 0x7f)
+
+def _id3_split(data, enc):
+    """ ID3 の文字列を終端で分割する (UTF-16 は 2 バイトの NUL) """
+    if enc in (1, 2):
+        for i in range(0, len(data) - 1, 2):
+            if data[i:i + 2] == b'\0\0': return data[:i], data[i + 2:]
+        return data, b''
+    i = data.find(b'\0')
+    return (data, b'') if i < 0 else (data[:i], data[i + 1:])
+
+def _id3_text(data, enc):
+    codec = ID3_ENCODINGS[enc] if enc < 4 else 'latin-1'
+    return data.decode(codec, 'replace').replace('\0', '/').strip('/')
+
+def _id3_frame(fid, data, tags):
+    if not data: return
+    enc = data[0]
+    if fid in ('TXXX', 'TXX'):
+        desc, value = _id3_split(data[1:], enc)
+        key = _id3_text(desc, enc) or fid
+        tags[key] = _id3_text(value, enc)
+    elif fid in ('COMM', 'COM', 'USLT', 'ULT'):
+        desc, value = _id3_split(data[4:], enc)
+        key = 'comment' if fid in ('COMM', 'COM') else 'lyrics'
+        desc = _id3_text(desc, enc)
+        tags[f"{key}-{desc}" if desc else key] = _id3_text(value, enc)
+    elif fid[0] == 'T':
+        tags[ID3_TAG_NAMES.get(fid, fid)] = _id3_text(data[1:], enc)
+    elif fid[0] == 'W' and fid != 'WXXX':
+        tags[fid] = data.decode('latin-1', 'replace').strip('\0')
+
+def read_id3v2(f, offset=0, limit=None):
+    """ offset にある ID3v2 を読む。戻り値は (tags, タグ全体のバイト数)。ID3v2 が無ければ ({}, 0)
+    フレームは 1 つずつファイルから読む。limit 指定時は長いフレームを先頭・末尾だけ読む (read_bounded) """
+    f.seek(offset)
+    hdr = f.read(10)
+    if len(hdr) < 10 or hdr[:3] != b'ID3' or hdr[3] not in (2, 3, 4): return {}, 0
+    major, flags = hdr[3], hdr[5]
+    size = _synchsafe(hdr[6:10])
+    total = 10 + size + (10 if flags & 0x10 else 0)
+    pos, end = offset + 10, offset + 10 + size
+    if flags & 0x80 and major < 4:
+        # タグ全体の非同期化 (v2.2/2.3) は戻してからでないとフレーム境界が分からないので全体を読む
+        body = f.read(size).replace(b'\xff\x00', b'\xff')
+        f, pos, end = io.BytesIO(body), 0, len(body)
+    if flags & 0x40 and major >= 3:
+        f.seek(pos)
+        b = f.read(4)
+        if len(b) < 4: return {}, total
+        pos += _synchsafe(b) if major == 4 else struct.unpack('>I', b)[0] + 4
+    tags = {}
+    id_len, hdr_len = (3, 6) if major == 2 else (4, 10)
+    while pos + hdr_len <= end:
+        f.seek(pos)
+        fhdr = f.read(hdr_len)
+        if len(fhdr) < hdr_len: break
+        fid = fhdr[:id_len]
+        if not fid.strip(b'\0') or not fid.isalnum(): break
+        raw = fhdr[id_len:id_len + (3 if major == 2 else 4)]
+        if major == 2: fsize = int.from_bytes(raw, 'big')
+        elif major == 4: fsize = _synchsafe(raw)
+        else: fsize = struct.unpack('>I', raw)[0]
+        fsize = min(fsize, end - pos - hdr_len)
+        fflags = 0 if major == 2 else struct.unpack('>H', fhdr[8:10])[0]
+        pos += hdr_len + fsize
+        if major == 4: compressed, encrypted = fflags & 0x0008, fflags & 0x0004
+        else: compressed, encrypted = major == 3 and fflags & 0x0080, major == 3 and fflags & 0x0040
+        if encrypted: continue
+        data = f.read(fsize) if compressed else read_bounded(f, fsize, limit)
+        if major == 4:
+            if fflags & 0x0001: data = data[4:]  # data length indicator
+            if fflags & 0x0002: data = data.replace(b'\xff\x00', b'\xff')
+        elif major == 3 and fflags & 0x0080: data = data[4:]
+        if compressed:
+            try: data = zlib.decompress(data)
+            except zlib.error: continue
+        _id3_frame(fid.decode('latin-1'), data, tags)
+    return tags, total
+
+ID3V1_GENRES_MAX = 191
+
+def read_id3v1(f, end):
+    """ ファイル末尾 128 バイトの ID3v1 を読む """
+    if end < 128: return {}
+    f.seek(end - 128)
+    b = f.read(128)
+    if b[:3] != b'TAG': return {}
+    text = lambda x: x.split(b'\0', 1)[0].decode('latin-1').strip()
+    tags = {'title': text(b[3:33]), 'artist': text(b[33:63]), 'album': text(b[63:93]), 'date': text(b[93:97])}
+    if b[125] == 0 and b[126]:
+        tags['comment'] = text(b[97:125])
+        tags['track'] = str(b[126])
+    else:
+        tags['comment'] = text(b[97:127])
+    if b[127] <= ID3V1_GENRES_MAX: tags['genre'] = str(b[127])
+    return {k: v for k, v in tags.items() if v}
+
+def find_apev2(f, end):
+    """ 末尾 (ID3v1 の手前を含む) の APEv2 を探し (タグ開始, 項目開始, フッタ末尾, 件数) を返す。無ければ None """
+    for tail in (end, end - 128):
+        if tail < 32: continue
+        f.seek(tail - 32)
+        footer = f.read(32)
+        if footer[:8] != b'APETAGEX': continue
+        _ver, size, count, flags = struct.unpack('<IIII', footer[8:24])
+        items = tail - size
+        start = items - (32 if flags & 0x80000000 else 0)
+        if size < 32 or start < 0: return None
+        return start, items, tail, count
+    return None
+
+def read_apev2(f, end):
+    ape = find_apev2(f, end)
+    if not ape: return {}
+    _, items_pos, tail, count = ape
+    f.seek(items_pos)
+    items = f.read(tail - 32 - items_pos)
+    tags = {}
+    pos = 0
+    for _ in range(count):
+        if pos + 8 > len(items): break
+        vsize, iflags = struct.unpack('<II', items[pos:pos + 8])
+        kend = items.find(b'\0', pos + 8)
+        if kend < 0: break
+        key = items[pos + 8:kend].decode('latin-1')
+        value = items[kend + 1:kend + 1 + vsize]
+        pos = kend + 1 + vsize
+        if (iflags >> 1) & 3 == 0: tags[key] = value.decode('utf-8', 'replace')
+    return tags
+
+def read_id3_tags(f, limit=None):
+    """ MP3 / ADTS AAC: 先頭の ID3v2、末尾の APEv2 と ID3v1 を読む """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    tags, _ = read_id3v2(f, limit=limit)
+    for k, v in read_apev2(f, end).items(): tags.setdefault(k, v)
+    for k, v in read_id3v1(f, end).items(): tags.setdefault(k, v)
+    return tags
+
+def parse_vorbis_comment(f, end, tags, limit=None):
+    """ Vorbis comment (FLAC / Ogg Vorbis / Opus 共通)。f の現在位置から end までを読む """
+    vlen = struct.unpack('<I', f.read(4))[0]
+    f.seek(vlen, os.SEEK_CUR)
+    count = struct.unpack('<I', f.read(4))[0]
+    for _ in range(count):
+        b = f.read(4)
+        if len(b) < 4: break
+        clen = max(0, min(struct.unpack("<I", b)[0], end - f.tell()))
+        entry = read_bounded(f, clen, limit).decode('utf-8', 'replace')
+        key, sep, value = entry.partition('=')
+        if sep and key: tags[VORBIS_TAG_NAMES.get(key.upper(), key)] = value
+
+def read_flac_tags(f, limit=None):
+    _, skip = read_id3v2(f)
+    f.seek(skip)
+    if f.read(4) != b'fLaC': raise ValueError("not FLAC")
+    tags = {}
+    while True:
+        hdr = f.read(4)
+        if len(hdr) < 4: break
+        btype, blen = hdr[0] & 0x7f, int.from_bytes(hdr[1:4], 'big')
+        start = f.tell()
+        if btype == 4: parse_vorbis_comment(f, start + blen, tags, limit)
+        f.seek(start + blen)
+        if hdr[0] & 0x80: break
+    return tags
+
+OGG_MAX_PAGES = 512
+
+def _ogg_packets(f):
+    """ 最初の論理ストリームのパケットを順に返す (ヘッダ部分だけ読めば十分) """
+    serial = None
+    packet = b''
+    for _ in range(OGG_MAX_PAGES):
+        hdr = f.read(27)
+        if len(hdr) < 27 or hdr[:4] != b'OggS': return
+        page_serial = hdr[14:18]
+        lacing = f.read(hdr[26])
+        body = f.read(sum(lacing))
+        if serial is None: serial = page_serial
+        if page_serial != serial: continue
+        pos = 0
+        for lace in lacing:
+            packet += body[pos:pos + lace]
+            pos += lace
+            if lace < 255:
+                yield packet
+                packet = b''
+
+def read_ogg_tags(f):
+    f.seek(0)
+    tags = {}
+    for i, packet in enumerate(_ogg_packets(f)):
+        if i == 0: continue  # 識別ヘッダ
+        if packet[:7] == b'\x03vorbis': parse_vorbis_comment(io.BytesIO(packet[7:]), len(packet) - 7, tags)
+        elif packet[:8] == b'OpusTags': parse_vorbis_comment(io.BytesIO(packet[8:]), len(packet) - 8, tags)
+        break
+    return tags
+
+def read_riff_tags(f):
+    f.seek(0)
+    hdr = f.read(12)
+    if len(hdr) < 12 or hdr[:4] != b'RIFF' or hdr[8:12] != b'WAVE': raise ValueError("not RIFF/WAVE")
+    f.seek(0, os.SEEK_END)
+    end = min(f.tell(), 8 + struct.unpack('<I', hdr[4:8])[0])
+    tags = {}
+    pos = 12
+    while pos + 8 <= end:
+        f.seek(pos)
+        cid, csize = struct.unpack('<4sI', f.read(8))
+        if cid == b'LIST' and csize >= 4 and f.read(4) == b'INFO':
+            body = f.read(csize - 4)
+            p = 0
+            while p + 8 <= len(body):
+                sid, ssize = struct.unpack('<4sI', body[p:p + 8])
+                value = body[p + 8:p + 8 + ssize].split(b'\0', 1)[0].decode('utf-8', 'replace')
+                if value: tags[RIFF_INFO_NAMES.get(sid, sid.decode('latin-1'))] = value
+                p += 8 + ssize + (ssize & 1)
+        elif cid == b'bext' and csize >= 346:
+            # Broadcast Wave: 作成者・日時などが入る
+            b = f.read(346)
+            text = lambda x: x.split(b'\0', 1)[0].decode('latin-1').strip()
+            for key, val in (('description', b[:256]), ('originator', b[256:288]),
+                             ('originator_reference', b[288:320]), ('origination_date', b[320:330]),
+                             ('origination_time', b[330:338])):
+                if text(val): tags[key] = text(val)
+        elif cid in (b'id3 ', b'ID3 '):
+            for k, v in read_id3v2(f, pos + 8)[0].items(): tags.setdefault(k, v)
+        pos += 8 + csize + (csize & 1)
+    return tags
+
+def read_native_tags(path, limit=None):
+    """ 対応コンテナならタグを {key: value} で返す。未対応・解析失敗なら None (ffprobe にフォールバック)
+    limit を指定すると limit バイトを超える値は先頭・末尾だけを読む (スキャン用。Ogg / WAV / APEv2 は常に全体) """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, 'rb') as f:
+            if ext in MP4_EXTS: return read_mp4_tags(f, limit)
+            if ext in MKV_EXTS: return read_mkv_tags(f, limit)
+            if ext in ID3_EXTS: return read_id3_tags(f, limit)
+            if ext == '.flac': return read_flac_tags(f, limit)
+            if ext in ('.ogg', '.opus'): return read_ogg_tags(f)
+            if ext == '.wav': return read_riff_tags(f)
+    except (OSError, ValueError, EOFError, struct.error):
+        pass
+    return None
+
+def has_native_tag_reader(ext):
+    return ext in MP4_EXTS or ext in MKV_EXTS or ext in AUDIO_TAG_EXTS
+
+def probe_media(path, ffprobe_path=None, timeout=3, limit=None):
+    """ 動画・音声のタグを 1 回の読み取りで {'format': {...}, 'streams': [{...}], 'chapters': [{...}]} にする。
+    ネイティブで読めるものは format tags だけ (streams / chapters は None)、それ以外は ffprobe を 1 回だけ起動する。
+    limit は read_native_tags に渡す (ffprobe の結果は常に全体)。読めなければ None """
+    tags = read_native_tags(path, limit)
+    if tags is not None: return {'format': tags, 'streams': None, 'chapters': None}
+    if not ffprobe_path: return None
+    # ■■■ FIX: creationflagsを追加 ■■■
+    cmd = [ffprobe_path, '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', '-show_chapters', path]
+    res = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', timeout=timeout, creationflags=creation_flags)
+    if res.returncode != 0: return None
+    data = json.loads(res.stdout)
+    return {'format': data.get('format', {}).get('tags', {}),
+            'streams': [st.get('tags', {}) for st in data.get('streams', [])],
+            'chapters': [ch.get('tags', {}) for ch in data.get('chapters', [])]}
+
+def read_format_tags(path, ffprobe_path=None, timeout=3):
+    """ コンテナの format tags を返す。ネイティブで読めない場合のみ ffprobe を起動する """
+    probe = probe_media(path, ffprobe_path, timeout)
+    return probe['format'] if probe else None
+
+# ==========================================
+# 🗂 PROBE CACHE (セッション中の解析結果)
+# ==========================================
+PROBE_CACHE_ENTRIES = 4096   # 種類 (kind) ごとの件数の上限
+PROBE_CACHE_BYTES = 64 << 20  # 種類ごとの値の合計サイズの目安。1 件でこの 1/8 を超えるものは保持しない
+
+def _approx_size(value):
+    """ タグ等の入れ子 (dict / list / 文字列) のおおよそのバイト数 """
+    if isinstance(value, (str, bytes)): return len(value) + 50
+    if isinstance(value, dict): return sum(_approx_size(k) + _approx_size(v) for k, v in value.items()) + 100
+    if isinstance(value, (list, tuple)): return sum(_approx_size(v) for v in value) + 50
+    return 30
+
+class ProbeCache:
+    """ 解析結果のセッション内 LRU キャッシュ。(path, size, mtime_ns) が変わらない間は、
+    スキャン・診断・比較のどこから読んでも 1 回の解析結果を使い回す。
+    種類 (kind) ごとに別々の LRU で保持する: 'media' (probe_media の結果)、'media_head' (スキャン用に長い値を
+    先頭・末尾だけ読んだ probe_media の結果)、'image' (Pillow / piexif の結果)、
+    'scan' (スキャン結果)。件数の多いスキャン結果が他の種類を追い出さないように、上限も種類ごとに持つ。 """
+
+    def __init__(self, max_entries=PROBE_CACHE_ENTRIES, max_bytes=PROBE_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = {}  # kind → OrderedDict(norm_path → (size, mtime_ns, value, nbytes))
+        self.nbytes = Counter()  # kind → 合計サイズ
+        self.lock = threading.Lock()
+
+    def get(self, path, kind, loader, st=None):
+        """ キャッシュにあればそれを、無ければ loader(path) の結果を返す (None は保持しない)。
+        st に (size, mtime_ns) を渡すと stat を省く """
+        if st is None:
+            s = os.stat(path)
+            st = (s.st_size, s.st_mtime_ns)
+        value = self.peek(path, kind, st)
+        if value is None:
+            value = loader(path)
+            if value is not None: self.put(path, kind, value, st)
+        return value
+
+    def peek(self, path, kind, st):
+        """ キャッシュにあれば返す (読み込みはしない) """
+        key = norm_path(path)
+        with self.lock:
+            entries = self.entries.get(kind)
+            hit = entries.get(key) if entries else None
+            if hit and hit[:2] == tuple(st):
+                entries.move_to_end(key)
+                return hit[2]
+        return None
+
+    def put(self, path, kind, value, st):
+        nbytes = _approx_size(value)
+        if nbytes > self.max_bytes // 8: return
+        key = norm_path(path)
+        with self.lock:
+            entries = self.entries.setdefault(kind, OrderedDict())
+            old = entries.pop(key, None)
+            if old: self.nbytes[kind] -= old[3]
+            entries[key] = (st[0], st[1], value, nbytes)
+            self.nbytes[kind] += nbytes
+            while entries and (len(entries) > self.max_entries or self.nbytes[kind] > self.max_bytes):
+                self.nbytes[kind] -= entries.popitem(last=False)[1][3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes.clear()
+
+# ==========================================
+# ✂ NATIVE MEDIA STRIPPER (MP4/MOV)
+# リマックスせず、コピー上のメタデータアトムだけを free アトムに置き換える
+# ==========================================
+# 再生に必要なアトムだけを親ごとに残す (それ以外の udta・meta・uuid・未知のアトムは free に置き換える)。
+# None はファイル直下。free/skip/wide は中身を書き換えない (オフセットを持たない詰め物)。
+# minf 以下 (サンプル表) と moof (フラグメント) は丸ごと残す
+MP4_KEEP_ATOMS = {
+    None: {b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'moof', b'mfra', b'sidx', b'ssix', b'styp', b'pdin'},
+    b'moov': {b'mvhd', b'trak', b'mvex', b'iods', b'pssh'},
+    b'trak': {b'tkhd', b'edts', b'tref', b'mdia'},
+    b'mdia': {b'mdhd', b'hdlr', b'minf', b'elng'},
+}
+# 作成・更新日時を持つ FullBox (mvhd / tkhd / mdhd)
+MP4_TIME_ATOMS = {b'mvhd', b'tkhd', b'mdhd'}
+# 時系列メタデータのトラック (GoPro の GPS/センサー gpmd、カメラ姿勢 camm、iPhone の位置情報 mebx 等)。
+# アトムの書き換えでは消せないので、見つけたら FFmpeg (映像・音声・字幕だけを残す) に任せる
+MP4_TIMED_META_HANDLERS = {b'meta', b'data', b'camm'}
+MP4_TIMED_META_ENTRIES = {b'gpmd', b'camm', b'mebx'}
+
+def _mp4_free(f, pos, hlen, size):
+    """ アトムの種別を free に変え、中身をゼロで塗りつぶす (サイズは変えないので stco 等のオフセットはそのまま) """
+    f.seek(pos + 4)
+    f.write(b'free')
+    f.seek(pos + hlen)
+    remaining = size - hlen
+    zeros = bytes(min(remaining, COPY_CHUNK))
+    while remaining > 0:
+        n = min(remaining, len(zeros))
+        f.write(zeros[:n])
+        remaining -= n
+
+def _mp4_clear_times(f, pos, hlen):
+    f.seek(pos + hlen)
+    version = f.read(1)
+    f.seek(pos + hlen + 4)
+    f.write(bytes(16 if version == b'\x01' else 8))
+
+def _mp4_neutralize(f, start, end, parent=None):
+    keep = MP4_KEEP_ATOMS[parent]
+    for typ, pos, hlen, size in list(_mp4_atoms(f, start, end)):
+        if typ not in keep:
+            _mp4_free(f, pos, hlen, size)
+        elif typ in MP4_TIME_ATOMS:
+            _mp4_clear_times(f, pos, hlen)
+        elif typ in MP4_KEEP_ATOMS:
+            _mp4_neutralize(f, pos + hlen, pos + size, typ)
+
+def _mp4_has_timed_meta(f, start, end):
+    """ hdlr が meta/data のトラック、または stsd に gpmd/camm/mebx のサンプルエントリがあるか """
+    for typ, pos, hlen, size in _mp4_atoms(f, start, end):
+        if typ in (b'moov', b'trak', b'mdia', b'minf', b'stbl'):
+            if _mp4_has_timed_meta(f, pos + hlen, pos + size): return True
+        elif typ == b'hdlr' and size >= hlen + 12:
+            f.seek(pos + hlen + 8)  # version/flags, pre_defined の後ろが handler_type
+            if f.read(4) in MP4_TIMED_META_HANDLERS: return True
+        elif typ == b'stsd' and size >= hlen + 8:
+            # version/flags, entry_count の後ろにサンプルエントリ (各 Box) が並ぶ
+            for entry, _, _, _ in _mp4_atoms(f, pos + hlen + 8, pos + size):
+                if entry in MP4_TIMED_META_ENTRIES: return True
+    return False
+
+def neutralize_mp4(src, dst):
+    """ MP4/MOV をコピーし、コピー側の MP4_KEEP_ATOMS 以外 (udta / meta / uuid 等) を free に置き換え、作成日時を 0 にする。
+    メディアデータ (mdat) は読み書きしないので、処理量はメタデータの大きさに比例する。
+    時系列メタデータのトラックがあるファイルは ValueError (FFmpeg でトラックごと落とす)。 """
+    with open(src, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        top = list(_mp4_atoms(f, 0, f.tell()))  # 壊れたファイルはコピー前に ValueError
+        moov = [(pos, hlen, size) for typ, pos, hlen, size in top if typ == b'moov']
+        if not moov: raise ValueError("moov not found")
+        pos, hlen, size = moov[0]
+        if _mp4_has_timed_meta(f, pos + hlen, pos + size): raise ValueError("timed metadata track")
+    clone_file(src, dst)  # reflink できればメタデータを書き換えたブロックだけが新たに確保される
+    with open(dst, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        _mp4_neutralize(f, 0, f.tell())
+    return True
+
+# ==========================================
+# ✂ NATIVE AUDIO STRIPPER (MP3/AAC, FLAC, WAV)
+# タグ部分を飛ばし、音声データはカーネル内コピー (copy_range) で写す
+# ==========================================
+FLAC_KEEP_BLOCKS = {0, 3}  # STREAMINFO, SEEKTABLE (シーク表のオフセットは最初のフレーム基準なので変わらない)
+# LIST (INFO/adtl)、ID3、Broadcast Wave (作成者情報)、iXML、XMP
+RIFF_DROP_CHUNKS = {b'LIST', b'id3 ', b'ID3 ', b'bext', b'iXML', b'_PMX'}
+
+def _id3_payload_range(fi):
+    """ 先頭の ID3v2 と末尾の ID3v1 / APEv2 を除いた範囲 (start, end) """
+    fi.seek(0, os.SEEK_END)
+    end = fi.tell()
+    start = 0
+    while True:
+        _, n = read_id3v2(fi, start)
+        if not n: break
+        start += n
+    if end - start >= 128:
+        fi.seek(end - 128)
+        if fi.read(3) == b'TAG': end -= 128
+    ape = find_apev2(fi, end)
+    if ape and ape[2] == end: end = ape[0]
+    if start >= end: raise ValueError("no audio data")
+    return start, end
+
+def strip_id3(src, dst):
+    """ MP3 / ADTS AAC: ID3v2 ヘッダと ID3v1・APEv2 トレーラを落とし、間のフレームだけをコピー """
+    with open(src, 'rb') as fi:
+        start, end = _id3_payload_range(fi)
+        with open(dst, 'wb') as fo:
+            copy_range(fi, fo, start, end - start)
+    return True
+
+def strip_flac(src, dst):
+    """ FLAC: STREAMINFO / SEEKTABLE 以外のメタデータブロック (Vorbis comment・画像など) を落とす """
+    with open(src, 'rb') as fi:
+        start, end = _id3_payload_range(fi)
+        fi.seek(start)
+        if fi.read(4) != b'fLaC': raise ValueError("not FLAC")
+        blocks = []
+        while True:
+            hdr = fi.read(4)
+            if len(hdr) < 4: raise ValueError("truncated FLAC")
+            btype, blen = hdr[0] & 0x7f, int.from_bytes(hdr[1:4], 'big')
+            if btype in FLAC_KEEP_BLOCKS: blocks.append((btype, fi.read(blen)))
+            else: fi.seek(blen, os.SEEK_CUR)
+            if hdr[0] & 0x80: break
+        audio = fi.tell()
+        if not blocks or blocks[0][0] != 0: raise ValueError("STREAMINFO missing")
+        with open(dst, 'wb') as fo:
+            fo.write(b'fLaC')
+            for i, (btype, data) in enumerate(blocks):
+                last = 0x80 if i == len(blocks) - 1 else 0
+                fo.write(bytes([btype | last]) + len(data).to_bytes(3, 'big') + data)
+            copy_range(fi, fo, audio, end - audio)
+    return True
+
+def strip_wav(src, dst):
+    """ WAV: RIFF_DROP_CHUNKS を落として RIFF サイズを直す。fmt / data などはそのまま """
+    with open(src, 'rb') as fi:
+        hdr = fi.read(12)
+        if len(hdr) < 12 or hdr[:4] != b'RIFF' or hdr[8:12] != b'WAVE': raise ValueError("not RIFF/WAVE")
+        fi.seek(0, os.SEEK_END)
+        end = min(fi.tell(), 8 + struct.unpack('<I', hdr[4:8])[0])
+        chunks = []
+        pos = 12
+        while pos + 8 <= end:
+            fi.seek(pos)
+            cid, csize = struct.unpack('<4sI', fi.read(8))
+            padded = min(csize + (csize & 1), end - pos - 8)
+            if cid not in RIFF_DROP_CHUNKS: chunks.append((cid, csize, pos + 8, padded))
+            pos += 8 + csize + (csize & 1)
+        if not any(cid == b'data' for cid, _, _, _ in chunks): raise ValueError("data chunk missing")
+        with open(dst, 'wb') as fo:
+            fo.write(b'RIFF' + struct.pack('<I', 4 + sum(8 + p for _, _, _, p in chunks)) + b'WAVE')
+            for cid, csize, data_pos, padded in chunks:
+                fo.write(struct.pack('<4sI', cid, csize))
+                copy_range(fi, fo, data_pos, padded)
+    return True
+
+MEDIA_STRIPPERS = {ext: neutralize_mp4 for ext in MP4_EXTS}
+MEDIA_STRIPPERS.update({'.mp3': strip_id3, '.aac': strip_id3, '.flac': strip_flac, '.wav': strip_wav})
+
+# FFmpeg でしか処理できない小さなファイルは、1 回の起動でまとめて処理する
+FFMPEG_BATCH_SIZE = 24                 # 1 コマンドあたりの入力数 (Windows のコマンドライン長にも余裕を持たせる)
+FFMPEG_BATCH_MAX_BYTES = 32 * 2**20    # これより大きいファイルは起動コストが無視できるので単独で処理
+FFMPEG_NO_SUBTITLE_EXTS = {'.avi', '.flv', '.wmv'}  # 字幕ストリームを入れられないコンテナ
+
+def ffmpeg_map_args(index, dst):
+    """ 入力 index の映像・音声・字幕・チャプターを残す指定 (データストリームは落ちる)。
+    まとめて処理する場合も 1 ファイルずつの場合も同じ指定にする """
+    args = ['-map', f'{index}:v?', '-map', f'{index}:a?']
+    if os.path.splitext(dst)[1].lower() not in FFMPEG_NO_SUBTITLE_EXTS: args += ['-map', f'{index}:s?']
+    return args + ['-map_chapters', str(index)]
+
+CLEAN_QUEUE_SIZE = 1024  # クリーニング時に走査結果を先読みしておく件数
+
+# ==========================================
+# 📁 FOLDER WALKER
+# ==========================================
+CLEAN_SUFFIX = "_clean"
+
+class FolderWalker:
+    """ os.scandir による再帰走査。ファイルごとに (パス, サイズ, 更新日時 ns, 変更日時 ns) を返す。
+    変更日時 (st_ctime_ns) は POSIX では内容・属性の変更で必ず進む (Windows では作成日時)。
+    クリーニングの出力先 (<名前>_clean と <名前> が同じ階層に並んでいるフォルダ) には入らない。
+    結果は保持しない (呼ぶたびに走査する)。 """
+    def files(self, folder, exts):
+        return [e for _, files in self.iter_dirs(folder) for e in files if os.path.splitext(e[0])[1].lower() in exts]
+
+    @staticmethod
+    def iter_dirs(folder, errors=None):
+        """ (フォルダ, [(パス, サイズ, 更新日時 ns, 変更日時 ns), ...]) をフォルダごとに順次返す (キャッシュしない)。
+        os.walk と同じ順番 (各フォルダのファイル → サブフォルダを先頭から)。
+        読めなかったフォルダ・項目は飛ばし、errors (リスト) を渡していれば (パス, 例外) を追加する。 """
+        stack = [folder]
+        while stack:
+            d = stack.pop()
+            try:
+                with os.scandir(d) as it: items = list(it)
+            except OSError as e:
+                if errors is not None: errors.append((d, e))
+                continue
+            dirs, files = [], []
+            for e in items:
+                try:
+                    if e.is_dir(follow_symlinks=False): dirs.append(e)
+                    elif e.is_file():
+                        st = e.stat()  # Windows ではディレクトリ一覧の情報がそのまま使われる
+                        files.append((e.path, st.st_size, st.st_mtime_ns, st.st_ctime_ns))
+                except OSError as err:
+                    if errors is not None: errors.append((e.path, err))
+            names = {e.name for e in dirs}
+            for e in reversed(dirs):
+                if e.name.endswith(CLEAN_SUFFIX) and e.name[:-len(CLEAN_SUFFIX)] in names: continue
+                stack.append(e.path)
+            yield d, files
+
+    @staticmethod
+    def dir_mtimes(folder):
+        """ folder 直下のファイルの {名前 (normcase): 更新日時 ns}。無いフォルダは空 """
+        try:
+            with os.scandir(folder) as it:
+                return {os.path.normcase(e.name): e.stat().st_mtime_ns for e in it if e.is_file()}
+        except OSError:
+            return {}
+
+# ==========================================
+# 📒 CLEAN MANIFEST
+# ==========================================
+MANIFEST_NAME = ".metadata_clean_manifest.sqlite3"
+QUICK_HASH_BYTES = 64 * 1024
+
+def file_digest(path):
+    """ ファイル全体の blake2b (マニフェストの記録・重複の最終確認用) """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''): h.update(chunk)
+    return h.hexdigest()
+
+def quick_hash(path):
+    """ サイズ + 先頭・末尾 QUICK_HASH_BYTES ずつの blake2b。重複候補の絞り込み用で、全体は読まない """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        h.update(size.to_bytes(8, 'little'))
+        h.update(f.read(QUICK_HASH_BYTES))
+        if size > QUICK_HASH_BYTES:
+            f.seek(max(QUICK_HASH_BYTES, size - QUICK_HASH_BYTES))
+            h.update(f.read(QUICK_HASH_BYTES))
+    return h.hexdigest()
+
+class CleanManifest:
+    """ 出力先 (<フォルダ>_clean) 直下の SQLite。元ファイルの相対パスごとに
+    (サイズ, 更新日時, 変更日時, 全体ハッシュ (file_digest。処理で全体を読むファイルだけ、他は NULL), 状態, 実行番号) を記録する。
+    状態 done は出力が最後まで書けたものだけで、停止・異常終了で書きかけになった出力は次回やり直される。
+    書き込みは BATCH 件ごとに 1 トランザクションでまとめて行う。 """
+    SCHEMA = 2
+    BATCH = 500
+
+    def __init__(self, dest_root):
+        self.dest_root = dest_root
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(dest_root, MANIFEST_NAME), timeout=10, check_same_thread=False)
+        self.pending = []
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files (rel TEXT PRIMARY KEY, size INTEGER, "
+                              "mtime_ns INTEGER, ctime_ns INTEGER, hash TEXT, state TEXT, run INTEGER)")
+            row = self.conn.execute("SELECT value FROM info WHERE key='schema'").fetchone()
+            if row is None or row[0] != str(self.SCHEMA):
+                self.conn.execute("DELETE FROM files")
+                self.conn.execute("INSERT OR REPLACE INTO info VALUES ('schema', ?)", (str(self.SCHEMA),))
+            row = self.conn.execute("SELECT value FROM info WHERE key='run'").fetchone()
+            self.run = int(row[0]) + 1 if row else 1
+            self.conn.execute("INSERT OR REPLACE INTO info VALUES ('run', ?)", (str(self.run),))
+            self.empty = self.conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def get(self, rel):
+        """ (size, mtime_ns, ctime_ns, hash, state) または None """
+        with self.lock:
+            return self.conn.execute("SELECT size, mtime_ns, ctime_ns, hash, state FROM files WHERE rel = ?",
+                                     (rel,)).fetchone()
+
+    def record(self, rel, size, mtime_ns, ctime_ns, digest, state):
+        """ 今回の実行で見つかったファイルとして記録する (state: done / failed) """
+        with self.lock:
+            self.pending.append((rel, size, mtime_ns, ctime_ns, digest, state, self.run))
+            if len(self.pending) >= self.BATCH: self._flush()
+
+    def flush(self):
+        with self.lock: self._flush()
+
+    def _flush(self):
+        if not self.pending: return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", self.pending)
+        self.pending = []
+
+    def prune(self):
+        """ 今回の走査で見つからなかった (元ファイルが削除・移動された) 出力と記録を消す。件数を返す """
+        with self.lock:
+            self._flush()
+            rels = [r for r, in self.conn.execute("SELECT rel FROM files WHERE run != ?", (self.run,))]
+        for rel in rels:
+            path = os.path.join(self.dest_root, rel)
+            try: os.remove(path)
+            except FileNotFoundError: pass
+            except OSError: continue
+            # 空になったフォルダも出力先の直下まで片付ける
+            d = os.path.dirname(path)
+            while len(d) > len(self.dest_root):
+                try: os.rmdir(d)
+                except OSError: break
+                d = os.path.dirname(d)
+            with self.lock: self.conn.execute("DELETE FROM files WHERE rel = ?", (rel,))
+        with self.lock: self.conn.commit()
+        return len(rels)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
+
+# ==========================================
+# 👯 DEDUP (内容が同じファイルは 1 回だけ処理)
+# ==========================================
+DEDUP_MAX_SIZES = 500_000  # 覚えておく (出力の種類, ファイルサイズ) の組の上限 (超えた分は重複排除しない)
+DEDUP_MAX_GROUP = 16       # 同じ組で中身の違うファイルを覚える上限
+
+def link_output(src, dst):
+    """ 処理済みの出力 src を dst として作る。reflink → ハードリンク → コピーの順に一時ファイルへ作ってから置き換える """
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    temp = temp_output(dst)
+    try:
+        if os.path.lexists(temp): os.remove(temp)
+        if not reflink_file(src, temp):
+            try: os.link(src, temp)
+            except OSError: clone_file(src, temp)
+        os.replace(temp, dst)
+        return True
+    except OSError:
+        return False
+    finally:
+        # dst が既に src と同じ実体 (前回のハードリンク) なら os.replace は何もしないので、ここで消す
+        if os.path.lexists(temp): os.remove(temp)
+
+class DedupEntry:
+    """ 同じ (出力の種類, サイズ) のファイルが 2 件以上見つかったときだけ作る、元ファイル 1 件分の記録。
+    ハッシュは比べる相手が現れたときに初めて計算する。完了待ちは DedupIndex の Condition で行う """
+    __slots__ = ('src', 'dst', 'quick', 'full', 'ok', 'finished')
+
+    def __init__(self, src, dst, quick=None, full=None):
+        self.src, self.dst = src, dst
+        self.quick, self.full = quick, full
+        self.ok = self.finished = False
+
+    def digest_if(self, quick):
+        """ quick_hash が一致すれば全体ハッシュを返す (一致しない・読めなければ None) """
+        try:
+            if self.quick is None: self.quick = quick_hash(self.src)
+            if self.quick != quick: return None
+            if self.full is None: self.full = file_digest(self.src)
+            return self.full
+        except OSError:
+            return None
+
+class DedupIndex:
+    """ 1 回のクリーニング中に見つけた元ファイルを (出力の種類, サイズ) → quick_hash → 全体ハッシュ の順に絞り込む。
+    出力の種類 (拡張子・処理方法) が違えば中身が同じでも出力は別物なのでまとめない。
+    (種類, サイズ) が初出のファイルは元ファイルのパスだけを覚え (ハッシュも計算しない)、同じ組の 2 件目が
+    来たときに初めて DedupEntry を作る。覚える組は DEDUP_MAX_SIZES、1 組のエントリは DEDUP_MAX_GROUP までなので、
+    メモリ使用量はフォルダの大きさに比例しない。 """
+
+    def __init__(self, dst_of):
+        self.dst_of = dst_of  # 元ファイル → 出力先
+        self.groups = {}      # (種類, サイズ) → 最初の元ファイルのパス、2 件目以降が来たら [DedupEntry]
+        self.running = set()  # 最初の元ファイルがまだ処理中の (種類, サイズ)
+        self.kinds = {}       # 種類のタプルを 1 つにまとめる
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.linked = 0
+
+    def claim(self, src, dst, size, kind=None, quick=None, full=None):
+        """ 同じ種類・内容の先行ファイルがあれば (そのエントリ, None)、無ければ (None, 自分の記録)。
+        full (全体ハッシュ) が分かっていれば渡す (計算し直さない)。
+        自分の記録は処理が終わったら finish() に渡す (後続の重複が待っている) """
+        with self.lock:
+            key = (self.kinds.setdefault(kind, kind), size)
+            group = self.groups.get(key)
+            if group is None:
+                if len(self.groups) >= DEDUP_MAX_SIZES: return None, None
+                self.groups[key] = src
+                self.running.add(key)
+                return None, (key, src)
+            if isinstance(group, str):
+                # 同じ組の 2 件目: ここで初めて最初のファイルのエントリを作る
+                first = DedupEntry(group, self.dst_of(group))
+                first.ok = first.finished = key not in self.running
+                group = self.groups[key] = [first]
+            group = list(group)
+        if quick is None: quick = quick_hash(src)
+        for entry in group:
+            digest = entry.digest_if(quick)
+            if digest is None: continue
+            if full is None: full = file_digest(src)
+            if digest == full: return entry, None
+        with self.lock:
+            group = self.groups[key]
+            if len(group) < DEDUP_MAX_GROUP: group.append(DedupEntry(src, dst, quick, full))
+        return None, (key, src)
+
+    def wait(self, entry):
+        """ entry の処理が終わるまで待ち、成功したかを返す """
+        with self.cond:
+            self.cond.wait_for(lambda: entry.finished)
+            return entry.ok
+
+    def finish(self, mine, ok):
+        """ claim() で受け取った自分の記録の処理結果を知らせる """
+        key, src = mine
+        with self.cond:
+            group = self.groups.get(key)
+            if isinstance(group, str):
+                # 2 件目はまだ来ていない: 失敗したら次に来たファイルを最初のファイルにする
+                self.running.discard(key)
+                if not ok and group == src: del self.groups[key]
+                return
+            for entry in group or ():
+                if entry.src == src:
+                    entry.ok, entry.finished = ok, True
+                    self.cond.notify_all()
+                    break
+
+# ==========================================
+# ⚙ ENGINE (スキャン / クリーニング本体)
+# ==========================================
+IMAGE_EXTS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.bmp'}
+VIDEO_EXTS = {'.mp4', '.mov', '.webm', '.mkv', '.avi', '.flv', '.wmv'}
+AUDIO_EXTS = {'.mp3', '.wav', '.flac', '.ogg', '.opus', '.m4a', '.aac'}
+MEDIA_EXTS = IMAGE_EXTS | VIDEO_EXTS | AUDIO_EXTS
+
+def risk_score(meta):
+    """ 危険度: GPS 40 + 著作者 30 + AI 生成情報 30 """
+    return (40 if meta['has_gps'] else 0) + (30 if meta['has_author'] else 0) + (30 if meta['has_ai'] else 0)
+
+def clean_dest_root(source):
+    """ クリーニング結果の出力先 (元フォルダと同じ階層の <フォルダ名>_clean)。
+    相対パス (".") も絶対パスにしてから決める。出力先が元フォルダの中になる場合 (ドライブ直下など) は ValueError """
+    source = os.path.abspath(source)
+    dest = os.path.join(os.path.dirname(source), f"{os.path.basename(source)}{CLEAN_SUFFIX}")
+    if os.path.commonpath([norm_path(source), norm_path(dest)]) == norm_path(source):
+        raise ValueError(f"cannot clean into the source folder: {dest}")
+    return dest
+
+class MetadataEngine:
+    """ tkinter に依存しないスキャン / クリーニング処理。
+    進捗・結果・ログはすべて on_event に dict ({'event': 種類, ...}) で渡す。
+    on_event はワーカースレッドから呼ばれることがある ('log' イベント)。 """
+
+    def __init__(self, ffmpeg_path=None, ffprobe_path=None, on_event=None, workers=DEFAULT_WORKERS, use_index=True):
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = ffprobe_path
+        self.on_event = on_event or (lambda event: None)
+        self.workers = workers
+        self.use_index = use_index
+        self.stop_requested = False
+        self.scan_index = None
+        self.mem_budget = None
+        self.mem_limit_mb = MEM_LIMIT_MB
+        self.probe_cache = ProbeCache()
+        self.dedup = True  # 内容が同じ元ファイルは 1 回だけ処理し、残りは出力をリンクする
+        self.ai_nodes = False  # スキャン時に AI 生成ファイルのノード種別 (ComfyUI) も抽出する
+        self.only_flagged = False  # スマート削除で、スキャン済みでメタデータの無い JPEG/PNG は処理せずコピーする
+        self.walker = FolderWalker()
+        self.discovered = 0
+        self.discovering = False
+
+    def emit(self, event, **data):
+        self.on_event({'event': event, **data})
+
+    def log(self, message, error=False):
+        self.emit('log', message=message, error=error)
+
+    def stop(self):
+        self.stop_requested = True
+
+    # === SCAN ===
+    def scan(self, folder):
+        """ folder 内の画像・動画・音声を調べる。
+        イベント: scan_start → scan_file (ファイルごと、元の順番) → scan_done (集計。戻り値と同じ) """
+        files = self.walker.files(folder, MEDIA_EXTS)
+        total = len(files)
+        self.emit('scan_start', folder=folder, total=total)
+        workers = max(1, int(self.workers))
+        gps_c = author_c = ai_c = danger_c = 0
+
+        # ■■■ スキャンインデックス: 前回から変化のないファイルは解析をスキップ ■■■
+        index = self._open_scan_index() if self.use_index else None
+        known = index.load(folder) if index else {}
+        new_rows = []
+        cached_c = 0
+
+        def scan_one(entry):
+            path, size, mtime_ns, _ = entry
+            key = norm_path(path)
+            hit = known.get(key)
+            if hit and hit[0] == size and hit[1] == mtime_ns:
+                meta = hit[2]
+                if not (self.ai_nodes and meta['has_ai'] and 'ai_nodes' not in meta): return meta, None
+                # ノード種別だけが未取得: 判定はそのままで抽出して記録し直す
+                meta = dict(meta, ai_nodes=self._ai_nodes(path))
+                return meta, (key, size, mtime_ns)
+            meta, parsed = self._get_simple_meta_info(path, (size, mtime_ns))
+            if self.ai_nodes and meta['has_ai']: meta['ai_nodes'] = self._ai_nodes(path)
+            # 解析できなかった (ffprobe 不在・タイムアウト・読み取り失敗) 結果は保存しない (次回また解析する)
+            if not parsed: return meta, False
+            return meta, (key, size, mtime_ns)
+
+        # ■■■ 並列スキャン: ffprobe/Pillow の読み取りを同時実行し、結果は元の順番で受け取る ■■■
+        results = run_parallel(scan_one, files, workers, lambda: self.stop_requested, ordered=True)
+        for i, ((path, size, mtime_ns, _), res, e) in enumerate(results):
+            if e is not None:
+                self.emit('scan_file', index=i + 1, total=total, path=path, error=str(e))
+                continue
+            meta, row = res
+            if meta.get('has_meta') is False:
+                # クリーニング (only_flagged) で使うのはメタデータの無いファイルだけ
+                self.probe_cache.put(path, 'scan', meta, (size, mtime_ns))
+            if row is None: cached_c += 1
+            elif row: new_rows.append(row + (meta,))
+            if index and len(new_rows) >= 500:
+                index.put_many(new_rows)
+                new_rows = []
+
+            if meta['has_gps']: gps_c += 1
+            if meta['has_author']: author_c += 1
+            if meta['has_ai']: ai_c += 1
+            score = risk_score(meta)
+            if score >= 30: danger_c += 1
+            extra = {'ai_nodes': meta['ai_nodes']} if 'ai_nodes' in meta else {}
+            self.emit('scan_file', index=i + 1, total=total, path=path, score=score, cached=row is None,
+                      has_gps=meta['has_gps'], has_author=meta['has_author'], has_ai=meta['has_ai'], **extra)
+
+        if index:
+            index.put_many(new_rows)
+            if not self.stop_requested:
+                seen = set(norm_path(f[0]) for f in files)
+                index.remove_many([p for p in known if p not in seen])
+
+        exts = Counter(os.path.splitext(f[0])[1].lower() for f in files)
+        summary = {'folder': folder, 'total': total, 'exts': dict(sorted(exts.items())),
+                   'gps': gps_c, 'author': author_c, 'ai': ai_c, 'high_risk': danger_c,
+                   'cached': cached_c if index else None, 'stopped': self.stop_requested}
+        self.emit('scan_done', **summary)
+        return summary
+
+    def _open_scan_index(self):
+        if self.scan_index is None:
+            try:
+                self.scan_index = ScanIndex()
+            except (OSError, sqlite3.Error) as e:
+                self.log(f"Index Err: {e}", True)
+                return None
+        return self.scan_index
+
+    def _ai_nodes(self, path):
+        """ AI 生成ファイルに埋め込まれた ComfyUI のノード種別と数 ({種別: 数}、多い順)。読めなければ {} """
+        ext = os.path.splitext(path)[1].lower()
+        try:
+            if ext == '.png': counts = png_ai_nodes(path)
+            elif ext in VIDEO_EXTS | AUDIO_EXTS: counts = tags_ai_nodes((self.probe(path) or {}).get('format', {}))
+            else: counts = Counter()
+        except (OSError, ValueError, struct.error, zlib.error, subprocess.SubprocessError):
+            counts = Counter()
+        return dict(counts.most_common())
+
+    def probe(self, path, timeout=3, st=None, head_only=False):
+        """ 動画・音声のタグ (probe_media の結果)。同じファイルはセッション中キャッシュから返す。
+        head_only (スキャン用) はネイティブで読める形式の長い値を先頭・末尾だけ読み、'media_head' に分けて保持する """
+        if head_only and has_native_tag_reader(os.path.splitext(path)[1].lower()):
+            if st is None:
+                s = os.stat(path)
+                st = (s.st_size, s.st_mtime_ns)
+            full = self.probe_cache.peek(path, 'media', st)
+            if full is not None: return full
+            return self.probe_cache.get(path, 'media_head', lambda p: probe_media(p, self.ffprobe_path, timeout, TAG_SCAN_LIMIT), st)
+        return self.probe_cache.get(path, 'media', lambda p: probe_media(p, self.ffprobe_path, timeout), st)
+
+    def _get_simple_meta_info(self, path, st=None):
+        """ (判定結果, 解析できたか) を返す。解析できなかった場合の判定結果は既定値 (該当なし) のまま。
+        has_meta (消すべきメタデータがあるか) は JPEG/PNG 以外・解析失敗時は「ある」とみなす """
+        info = {'has_gps': False, 'has_author': False, 'has_ai': False, 'has_meta': True}
+        ext = os.path.splitext(path)[1].lower()
+        parsed = False
+        try:
+            if ext in HEADER_SCAN_EXTS:
+                # ■■■ JPEG/PNG はヘッダ部分 (SOS の手前 / IDAT 以外のチャンク) だけを読んで判定 ■■■
+                info.update(scan_image_header(path))
+                parsed = True
+            elif ext in (VIDEO_EXTS | AUDIO_EXTS):
+                # ■■■ MP4/MOV/MKV/WebM・主要な音声形式はネイティブ読み取り、それ以外のみ ffprobe ■■■
+                probe = self.probe(path, st=st, head_only=True)
+                parsed = probe is not None
+                tags = (probe or {}).get('format', {})
+                for k, v in tags.items():
+                    kl = k.lower()
+                    if 'location' in kl or 'gps' in kl: info['has_gps'] = True
+                    if 'artist' in kl or 'author' in kl: info['has_author'] = True
+                    if isinstance(v, str) and is_ai_tag(k, v): info['has_ai'] = True
+        except Exception:
+            parsed = False
+        return info, parsed
+
+    # === CLEANING ===
+    def iter_targets(self, source, dest_root, diff=False, manifest=None, errors=None):
+        """ 走査しながら (元ファイル, 出力先, 記録情報) を順次返す。記録情報は (相対パス, サイズ, 更新日時, 変更日時, hash)。
+        diff=True なら変更のないファイルを除く: マニフェストで done のファイルは (サイズ, 更新日時, 変更日時) が同じなら
+        そのまま、違っていてもファイル全体のハッシュが記録と同じなら変更なしとみなす (出力先は stat しない)。
+        ハッシュを記録していないファイル (処理で全体を読まない MP4 等) は、日時が変われば処理し直す。
+        出力先の更新日時と比べるのは、マニフェストを今回作ったとき (旧バージョンの出力) だけ。
+        それ以外でマニフェストに done が無いファイルは、出力があっても書きかけかもしれないので処理し直す。
+        見つけた件数は self.discovered、走査中かどうかは self.discovering に入る。
+        読めなかったフォルダ・ファイルは errors (リスト) に (パス, 例外) で追加する。 """
+        n = len(os.path.join(source, ''))
+        for d, files in self.walker.iter_dirs(source, errors):
+            files = [f for f in files if os.path.splitext(f[0])[1].lower() in MEDIA_EXTS]
+            if not files: continue
+            dest_dir = os.path.join(dest_root, d[n:])
+            dest_mtimes = None
+            for src, size, mtime_ns, ctime_ns in files:
+                name = os.path.basename(src)
+                rel = os.path.normcase(src[n:])
+                digest = None
+                if diff:
+                    row = manifest.get(rel) if manifest else None
+                    if row and row[4] == 'done':
+                        if row[:3] == (size, mtime_ns, ctime_ns):
+                            manifest.record(rel, size, mtime_ns, ctime_ns, row[3], 'done')
+                            continue
+                        if size == row[0] and row[3]:
+                            try: digest = file_digest(src)
+                            except OSError: pass
+                        if digest is not None and digest == row[3]:
+                            manifest.record(rel, size, mtime_ns, ctime_ns, digest, 'done')
+                            continue
+                    elif row is None and (manifest is None or manifest.empty):
+                        if dest_mtimes is None: dest_mtimes = FolderWalker.dir_mtimes(dest_dir)
+                        dst_mtime = dest_mtimes.get(os.path.normcase(name))
+                        if dst_mtime is not None and mtime_ns <= dst_mtime:
+                            # 旧バージョンの出力はハッシュを取らずに記録する (日時が変われば処理し直す)
+                            if manifest: manifest.record(rel, size, mtime_ns, ctime_ns, None, 'done')
+                            continue
+                self.discovered += 1
+                yield src, os.path.join(dest_dir, name), (rel, size, mtime_ns, ctime_ns, digest)
+        self.discovering = False
+
+    def _open_manifest(self, dest_root):
+        try:
+            return CleanManifest(dest_root)
+        except (OSError, sqlite3.Error) as e:
+            self.log(f"Manifest Err: {e}", True)
+            return None
+
+    def clean(self, source, strat="new", mode="smart"):
+        """ source を <source>_clean へクリーニングする。
+        strat: new (上書きコピー) / diff (新規・更新ファイルのみ) / overwrite (出力先を削除してから)
+        走査と処理は並行して進む (走査結果は CLEAN_QUEUE_SIZE 件までしかためない)。
+        結果は出力先のマニフェスト (CleanManifest) に記録し、最後まで走査できて読めないフォルダも無かった場合だけ、
+        元ファイルが無くなった出力を消す (読めなかったフォルダの出力まで消さないように)。
+        only_flagged (スマート削除のみ) なら、スキャン済みでメタデータの無い JPEG/PNG は処理せずにコピーする。
+        イベント: clean_start → clean_file (完了順。total はその時点で見つかった件数、走査中は discovering=True)
+                  → clean_done (集計。戻り値と同じ) """
+        dest_root = clean_dest_root(source)
+        if strat == "overwrite" and os.path.exists(dest_root):
+            shutil.rmtree(dest_root, onerror=remove_readonly)
+        os.makedirs(dest_root, exist_ok=True)
+
+        workers = max(1, int(self.workers))
+        self.discovered, self.discovering = 0, True
+        manifest = self._open_manifest(dest_root)
+        n = len(os.path.join(source, ''))
+        dedup = DedupIndex(lambda src: os.path.join(dest_root, src[n:])) if self.dedup else None
+        index = self._open_scan_index() if self.only_flagged and mode == "smart" and self.use_index else None
+        self.emit('clean_start', source=source, dest=dest_root, strategy=strat, mode=mode, total=None)
+        ok = err = done = pruned = passed = 0
+        read_errors = []
+        self.mem_budget = MemoryBudget(self.mem_limit_mb * workers * 2**20)
+
+        # ■■■ 並列処理: ワーカー数分のジョブを同時に実行。ジョブは 1 ファイル、または FFmpeg でまとめて処理する小さなファイル群 ■■■
+        def work(job):
+            nonlocal passed
+            # スキャンでメタデータが無いと分かっているファイルはコピーだけ (残りを通常どおり処理)
+            results = [None] * len(job)
+            if self.only_flagged and mode == "smart":
+                for i, (src, dst, info) in enumerate(job):
+                    if self._scanned_clean(src, info[1], info[2], index):
+                        results[i] = self._pass_through(src, dst)
+                        with lock: passed += 1
+            rest = [i for i, r in enumerate(results) if r is None]
+            # 記録用の全体ハッシュは処理する前の内容で取る (diff で計算済みならそれを使う。重複排除の確認にも使う)。
+            # 処理で全体を読まないファイル (MP4 の書き換え・音声のカーネル内コピー・コピーのみ) はハッシュを取らない
+            digests = [info[4] for _, _, info in job]
+            for i in rest:
+                src = job[i][0]
+                if manifest and digests[i] is None and self._reads_whole(src, mode):
+                    try: digests[i] = file_digest(src)
+                    except OSError: pass
+            if len(rest) > 1:
+                for i, r in zip(rest, self.process_ffmpeg_batch([job[i][:2] for i in rest], mode)): results[i] = r
+            elif rest:
+                src, dst, info = job[rest[0]]
+                results[rest[0]] = self._clean_one(src, dst, info[1], digests[rest[0]], mode, dedup)
+            return results, digests
+        lock = threading.Lock()
+        should_stop = lambda: self.stop_requested
+        try:
+            targets = prefetch(self.iter_targets(source, dest_root, strat == "diff", manifest, read_errors),
+                               CLEAN_QUEUE_SIZE, should_stop)
+            for job, res, e in run_parallel(work, self._group_jobs(targets, mode), workers, should_stop):
+                if e is not None:
+                    self.log(f"⚠ Err: {os.path.basename(job[0][0])} - {e}", True)
+                    res = ([False] * len(job), [None] * len(job))
+                for (src, dst, info), r, digest in zip(job, *res):
+                    done += 1
+                    if r: ok += 1
+                    else: err += 1
+                    if manifest: manifest.record(*info[:4], digest, 'done' if r else 'failed')
+                    self.emit('clean_file', index=done, total=self.discovered, discovering=self.discovering,
+                              src=src, dst=dst, ok=bool(r))
+            for path, e in read_errors: self.log(f"⚠ Read Err: {path} - {e}", True)
+            if manifest and not self.stop_requested:
+                if read_errors:
+                    self.log(f"⚠ Prune skipped: {len(read_errors)} unreadable", True)
+                else:
+                    pruned = manifest.prune()
+                    if pruned: self.log(f"🗑 Pruned: {pruned}")
+        finally:
+            if manifest: manifest.close()
+
+        summary = {'source': source, 'dest': dest_root, 'total': self.discovered, 'done': done,
+                   'ok': ok, 'err': err, 'linked': dedup.linked if dedup else 0, 'passed': passed, 'pruned': pruned,
+                   'unreadable': len(read_errors), 'stopped': self.stop_requested}
+        self.emit('clean_done', **summary)
+        return summary
+
+    def _scanned_clean(self, src, size, mtime_ns, index=None):
+        """ スキャン結果 (セッション内 → スキャンインデックスの順に探す) で、スマート削除しても何も変わらないと
+        分かっている JPEG/PNG か。スキャン後にサイズ・更新日時が変わったファイルは対象外 """
+        if os.path.splitext(src)[1].lower() not in HEADER_SCAN_EXTS: return False
+        meta = self.probe_cache.peek(src, 'scan', (size, mtime_ns))
+        if meta is None and index:
+            row = index.get(src)
+            if row and row[:2] == (size, mtime_ns): meta = row[2]
+        return meta is not None and meta.get('has_meta') is False
+
+    def _pass_through(self, src, dst):
+        """ 処理せずにコピーする (reflink が使えれば中身は複製しない) """
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        temp = temp_output(dst)
+        try:
+            fast_copy(src, temp)
+            os.replace(temp, dst)
+        finally:
+            if os.path.exists(temp): os.remove(temp)
+        return True
+
+    def _clean_one(self, src, dst, size, full, mode, dedup=None):
+        """ 1 ファイルを処理する。先に同じ内容のファイルが処理されていれば、その出力をリンクして使い回す。
+        先行ファイルは必ず先にジョブを開始しているので (実行順は投入順)、完了を待っても詰まらない。 """
+        if dedup is None: return self.process_file(src, dst, mode)
+        kind = (os.path.splitext(dst)[1].lower(), self._clean_route(src, mode))
+        try: owner, mine = dedup.claim(src, dst, size, kind, full=full)
+        except OSError: owner, mine = None, None
+        if owner:
+            if dedup.wait(owner) and link_output(owner.dst, dst):
+                with dedup.lock: dedup.linked += 1
+                return True
+        ok = False
+        try:
+            ok = self.process_file(src, dst, mode)
+            return ok
+        finally:
+            if mine: dedup.finish(mine, ok)
+
+    def _clean_route(self, src, mode):
+        """ 処理方法: native (構造の書き換え) / reencode (再エンコード) / ffmpeg / copy """
+        ext = os.path.splitext(src)[1].lower()
+        if ext in IMAGE_EXTS: return "native" if mode == "smart" and ext in IMAGE_STRIPPERS else "reencode"
+        if mode == "smart" and ext in MEDIA_STRIPPERS: return "native"
+        return "ffmpeg" if ext in VIDEO_EXTS | AUDIO_EXTS else "copy"
+
+    def _reads_whole(self, src, mode):
+        """ 処理で元ファイル全体を読むか (画像の書き換え・再エンコード / FFmpeg)。ハッシュを取っても読み込みは増えない """
+        return os.path.splitext(src)[1].lower() in IMAGE_EXTS or self._clean_route(src, mode) == "ffmpeg"
+
+    def _needs_ffmpeg(self, src, mode):
+        """ ネイティブ処理がなく、FFmpeg でしか処理できない動画・音声か """
+        ext = os.path.splitext(src)[1].lower()
+        if ext not in VIDEO_EXTS | AUDIO_EXTS: return False
+        return not (mode == "smart" and ext in MEDIA_STRIPPERS)
+
+    def _group_jobs(self, targets, mode):
+        """ targets を処理単位に分ける。FFmpeg 専用の小さなファイルは FFMPEG_BATCH_SIZE 件ずつ 1 ジョブにまとめる """
+        batch = []
+        for target in targets:
+            src = target[0]
+            small = False
+            if self.ffmpeg_path and self._needs_ffmpeg(src, mode):
+                try: small = os.path.getsize(src) <= FFMPEG_BATCH_MAX_BYTES
+                except OSError: pass
+            if not small:
+                yield [target]
+                continue
+            batch.append(target)
+            if len(batch) >= FFMPEG_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch: yield batch
+
+    def _run_ffmpeg(self, cmd, srcs):
+        """ run_ffmpeg を停止ボタンと進捗イベント (clean_progress: 出力済みバイト数 / 元ファイルの合計サイズ) につなぐ """
+        total = 0
+        for src in srcs:
+            try: total += os.path.getsize(src)
+            except OSError: pass
+        def progress(done_bytes, out_time_us):
+            self.emit('clean_progress', src=srcs[0], files=len(srcs), bytes=done_bytes, total=total)
+        run_ffmpeg(cmd, lambda: self.stop_requested, progress)
+
+    def process_ffmpeg_batch(self, pairs, mode="smart"):
+        """ 複数の入力を 1 回の FFmpeg 起動で処理する (入力ごとに出力を 1 つ割り当てる)。
+        コマンド全体が失敗した場合や出力が欠けた場合は、そのファイルだけ process_file でやり直す。 """
+        cmd = [self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error']
+        for src, _ in pairs: cmd += ['-i', src]
+        temps = []
+        for i, (src, dst) in enumerate(pairs):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            temp = temp_output(dst)
+            temps.append(temp)
+            cmd += ffmpeg_map_args(i, dst) + ['-map_metadata', '-1', '-c', 'copy', temp]
+
+        try:
+            self._run_ffmpeg(cmd, [src for src, _ in pairs])
+            batch_ok = True
+        except FFmpegCancelled as e:
+            # 停止・タイムアウト: 1 件ずつのやり直しはしない
+            self.log(f"⏹ FFmpeg: {os.path.basename(pairs[0][0])} +{len(pairs) - 1} - {e}", e.args[0] != "stopped")
+            for temp in temps:
+                if os.path.exists(temp): os.remove(temp)
+            return [False] * len(pairs)
+        except Exception:
+            batch_ok = False
+
+        results = []
+        for (src, dst), temp in zip(pairs, temps):
+            if batch_ok and os.path.exists(temp):
+                try:
+                    os.replace(temp, dst)
+                    results.append(True)
+                    continue
+                except OSError:
+                    pass
+            if os.path.exists(temp): os.remove(temp)
+            results.append(self.process_file(src, dst, mode))
+        return results
+
+    def process_file(self, src, dst, mode="smart"):
+        """ src を処理して dst に書き出す。一時ファイルに書いてから置き換えるので、途中で落ちても dst は
+        前回の出力のまま (ハードリンクで共有していた出力も os.replace で切り離される)。 """
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        temp = temp_output(dst)
+        try:
+            if os.path.exists(temp): os.remove(temp)
+            ok = self._write_clean(src, temp, mode)
+            if os.path.exists(temp): os.replace(temp, dst)
+            return ok
+        finally:
+            # 中断 (KeyboardInterrupt 含む) で残った一時ファイルを消す
+            if os.path.exists(temp): os.remove(temp)
+
+    def _write_clean(self, src, out, mode):
+        """ process_file の本体。out (一時ファイル) に書き出し、処理できたかを返す """
+        ext = os.path.splitext(src)[1].lower()
+        
+        stripper = IMAGE_STRIPPERS.get(ext) if mode == "smart" else None
+        if ext in IMAGE_EXTS and (HAS_PIL or stripper):
+            try:
+                if stripper:
+                    # ■■■ ファイル構造だけを書き換えるロスレス除去 (画像データは無変更)。扱えない場合は再エンコードへ ■■■
+                    try:
+                        return stripper(src, out)
+                    except (ValueError, struct.error):
+                        if not HAS_PIL: raise
+
+                # ■■■ 再エンコード (完全削除モード / スマート削除で構造編集できない形式) ■■■
+                return reencode_image(src, out, self.mem_budget)
+            except Exception as e:
+                self.log(f"Img Err: {e}", True)
+                fast_copy(src, out)
+                return False
+
+        media_stripper = MEDIA_STRIPPERS.get(ext) if mode == "smart" else None
+        if media_stripper:
+            # ■■■ リマックスせずにメタデータ部分だけを書き換える。扱えないファイルは FFmpeg へ ■■■
+            try:
+                return media_stripper(src, out)
+            except (ValueError, struct.error) as e:
+                self.log(f"Native Err: {os.path.basename(src)} - {e}", True)
+                if os.path.exists(out): os.remove(out)
+
+        if ext in VIDEO_EXTS | AUDIO_EXTS and not self.ffmpeg_path:
+            # FFmpeg が無いと消せない: メタデータ付きのままコピーせず、失敗として残す
+            self.log(f"⏭ Skipped (FFmpeg not found): {os.path.basename(src)}", True)
+            return False
+
+        try:
+            cmd = []
+            if ext in VIDEO_EXTS | AUDIO_EXTS:
+                cmd = [self.ffmpeg_path, '-y', '-hide_banner', '-loglevel', 'error', '-i', src,
+                       *ffmpeg_map_args(0, out), '-map_metadata', '-1', '-c', 'copy', out]
+            else:
+                fast_copy(src, out)
+                return True
+
+            self._run_ffmpeg(cmd, [src])
+            if os.path.exists(out): return True
+            raise Exception("Output fail")
+        except FFmpegCancelled as e:
+            # 停止・タイムアウト: 元ファイルのコピーも作らない (マニフェストには failed として残り、次回やり直す)
+            self.log(f"⏹ FFmpeg: {os.path.basename(src)} - {e}", e.args[0] != "stopped")
+            if os.path.exists(out): os.remove(out)
+            return False
+        except Exception as e:
+            detail = (getattr(e, 'stderr', None) or '').strip().splitlines()
+            self.log(f"FFmpeg Err: {e}" + (f" - {detail[-1]}" if detail else ""), True)
+            fast_copy(src, out)
+            return False
+
+    # === DETAIL ===
+    def _read_image_meta(self, path):
+        """ 詳細表示用の画像メタデータ: PNG は img.info (Pillow は最初の IDAT までしか読まない)、JPEG は piexif の dict。
+        JPEG はスキャンと同じく SOS の手前のセグメントだけを読み、Exif (APP1) だけを piexif に渡す (ファイル全体は読まない) """
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.png':
+            with Image.open(path) as img: return dict(img.info)
+        if ext in ['.jpg', '.jpeg']:
+            with open(path, 'rb') as f:
+                for marker, data in iter_jpeg_segments(f):
+                    if marker == JPEG_APP1 and data.startswith(EXIF_HEADER): return piexif.load(data)
+            return {'0th': {}, 'Exif': {}, 'GPS': {}, 'Interop': {}, '1st': {}, 'thumbnail': None}
+        return {}
+
+    def extract_metadata_detail(self, path):
+        st = os.stat(path)
+        text = f"File: {os.path.basename(path)}\nSize: {st.st_size:,} bytes\n" + "-"*30 + "\n"
+        ext = os.path.splitext(path)[1].lower()
+        LIMIT = 1000
+        def clip(v):
+            s = str(v)
+            return s if len(s) <= LIMIT else s[:LIMIT] + f"\n... ({len(s)-LIMIT:,} more)"
+
+        if (self.ffprobe_path or has_native_tag_reader(ext)) and (ext in VIDEO_EXTS | AUDIO_EXTS):
+            try:
+                probe = self.probe(path, timeout=5, st=(st.st_size, st.st_mtime_ns))
+                if probe is None: raise ValueError("probe failed")
+                # format tags に加え、ffprobe で読んだ場合はストリーム・チャプターのタグも表示
+                sections = [(None, probe['format'])]
+                sections += [(f"stream #{i}", t) for i, t in enumerate(probe['streams'] or []) if t]
+                sections += [(f"chapter #{i}", t) for i, t in enumerate(probe['chapters'] or []) if t]
+                if not any(t for _, t in sections): text += "✓ No Metadata"
+                for title, tags in sections:
+                    if title: text += f"--- {title} ---\n"
+                    for k, v in tags.items():
+                        text += f"[{k}] : {clip(v)}\n\n"
+            except Exception as e: text += f"Error: {e}"
+        elif HAS_PIL and ext in IMAGE_EXTS:
+            try:
+                meta = self.probe_cache.get(path, 'image', self._read_image_meta, (st.st_size, st.st_mtime_ns))
+                if ext == '.png':
+                    if not meta: text += "✓ No PNG Info"
+                    for k, v in meta.items():
+                        text += f"[{k}] : {clip(v)}\n\n"
+                elif ext in ['.jpg', '.jpeg']:
+                    ed = meta
+                    has_d = False
+                    for ifd in ed:
+                        if ifd == "thumbnail": continue
+                        if ed[ifd]:
+                            text += f"--- {ifd} ---\n"
+                            for tag, val in ed[ifd].items():
+                                has_d = True
+                                s = str(val)
+                                if isinstance(val, bytes) and len(val) > 100: s = f"<{len(val)} bytes binary>"
+                                elif len(s) > LIMIT: s = s[:LIMIT] + f"\n... ({len(s)-LIMIT:,} more)"
+                                t_name = piexif.TAGS[ifd].get(tag, {}).get('name', tag)
+                                text += f"{t_name}: {s}\n"
+                    if not has_d: text += "✓ No Exif Data"
+            except Exception as e: text += f"Error: {e}"
+        return text
+
+# ==========================================
+# 💻 CLI
+# ==========================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="metadata_engine",
+                                     description="Metadata Scan&Clean (headless). Events are written to stdout as JSON lines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("scan", "report GPS / author / AI metadata"),
+                            ("clean", "clean FOLDER into FOLDER_clean"),
+                            ("diff", "clean only files that are new or updated since the last run")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("folder")
+        p.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+        p.add_argument("--ffmpeg", help="path to ffmpeg (default: auto-detect)")
+        p.add_argument("--ffprobe", help="path to ffprobe (default: auto-detect)")
+        p.add_argument("--no-index", action="store_true", help="do not read or update the scan index")
+        if name == "scan":
+            p.add_argument("--ai-nodes", action="store_true", help="list ComfyUI node types of AI-generated files")
+        if name != "scan":
+            p.add_argument("--mode", choices=("smart", "full"), default="smart")
+            p.add_argument("--no-dedup", action="store_true", help="clean byte-identical files separately instead of linking")
+            p.add_argument("--only-flagged", action="store_true",
+                           help="copy JPEG/PNG files the last scan found metadata-free instead of processing them (smart mode)")
+            p.add_argument("--mem-limit-mb", type=int, default=MEM_LIMIT_MB,
+                           help=f"memory budget per worker for decoding images in MB (default: {MEM_LIMIT_MB})")
+        if name == "clean":
+            p.add_argument("--overwrite", action="store_true", help="delete FOLDER_clean before cleaning")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.folder): parser.error(f"not a folder: {args.folder}")
+    if args.command != "scan":
+        try: clean_dest_root(args.folder)
+        except ValueError as e: parser.error(str(e))
+
+    # ログはワーカースレッドからも届くので、1 行ずつロックして書き出す
+    lock = threading.Lock()
+    def write_event(event):
+        line = json.dumps(event)
+        with lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    engine = MetadataEngine(args.ffmpeg or get_ffmpeg_path(), args.ffprobe or get_ffprobe_path(),
+                            write_event, max(1, args.workers), not args.no_index)
+    engine.dedup = not getattr(args, 'no_dedup', False)
+    engine.ai_nodes = getattr(args, 'ai_nodes', False)
+    engine.only_flagged = getattr(args, 'only_flagged', False)
+    engine.mem_limit_mb = max(1, getattr(args, 'mem_limit_mb', MEM_LIMIT_MB))
+    try:
+        if args.command == "scan":
+            engine.scan(args.folder)
+            return 0
+        strat = "diff" if args.command == "diff" else ("overwrite" if args.overwrite else "new")
+        result = engine.clean(args.folder, strat, args.mode)
+        return 1 if result['err'] else 0
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        write_event({'event': 'error', 'message': str(e)})
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main())